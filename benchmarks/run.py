@@ -0,0 +1,286 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+"""
+benchmarks.run
+~~~~~~~~~~~~~~
+
+Benchmarks for the plugin stack. Runs against the fake Selenium RC server
+and an in-memory SQLite database, so neither a browser nor a database
+server is needed::
+
+   python benchmarks/run.py --output results.json
+
+The results are written as JSON, one entry per benchmark with the timings
+in seconds.
+
+:copyright: 2010-2011, Pascal Hartig <phartig@weluse.de>
+:license: BSD, see LICENSE for more details.
+"""
+
+import os
+import sys
+import json
+import socket
+import tempfile
+import platform
+import datetime
+
+from optparse import OptionParser
+from timeit import default_timer
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(
+    __file__))))
+
+
+def _free_port():
+    """Asks the OS for a port that is currently unused."""
+
+    sock = socket.socket()
+    sock.bind(('127.0.0.1', 0))
+    port = sock.getsockname()[1]
+    sock.close()
+    return port
+
+
+def configure(selenium_port):
+    """Configures a minimal django project."""
+
+    from django.conf import settings
+
+    settings.configure(
+        DEBUG=False,
+        DATABASES={
+            'default': {
+                'ENGINE': 'django.db.backends.sqlite3',
+                'NAME': ':memory:',
+                'TEST_NAME': ':memory:',
+            },
+        },
+        INSTALLED_APPS=[
+            'django.contrib.auth',
+            'django.contrib.contenttypes',
+        ],
+        ROOT_URLCONF='',
+        STATIC_URL='/static/',
+        SELENIUM_HOST='127.0.0.1',
+        SELENIUM_PORT=selenium_port,
+        SELENIUM_URL_ROOT='http://127.0.0.1:%d/' % _free_port(),
+        LIVE_SERVER_ADDRESS='127.0.0.1',
+        LIVE_SERVER_PORT=_free_port(),
+    )
+
+
+def measure(func, iterations, setup=None, teardown=None):
+    """Runs `func` `iterations` times and returns the single timings."""
+
+    timings = []
+    for i in range(iterations):
+        if setup is not None:
+            setup()
+        start = default_timer()
+        func()
+        timings.append(default_timer() - start)
+        if teardown is not None:
+            teardown()
+    return timings
+
+
+def summarize(name, timings, **params):
+    """Builds a result entry for a list of timings."""
+
+    ordered = sorted(timings)
+    return {
+        'name': name,
+        'params': params,
+        'iterations': len(timings),
+        'min': ordered[0],
+        'max': ordered[-1],
+        'mean': sum(ordered) / len(ordered),
+        'median': ordered[len(ordered) // 2],
+    }
+
+
+def make_test(attrs):
+    """Wraps a test case class with the given attributes like nose does."""
+
+    from unittest import TestCase
+    from nose.case import Test
+
+    attrs = dict(attrs)
+    attrs['runTest'] = lambda self: None
+    case = type('BenchmarkTest', (TestCase,), attrs)
+    return Test(case())
+
+
+def bench_selenium_session(iterations):
+    """Session start and stop in SeleniumPlugin."""
+
+    from noseselenium.plugins import SeleniumPlugin
+
+    plugin = SeleniumPlugin()
+    test = make_test({'selenium_test': True})
+
+    def run():
+        plugin.startTest(test)
+        plugin.stopTest(test)
+
+    return [summarize('selenium_session', measure(run, iterations))]
+
+
+def bench_live_server(iterations):
+    """Live server start and stop for both backends."""
+
+    from noseselenium.plugins import DjangoLiveServerPlugin, \
+            CherryPyLiveServerPlugin
+
+    results = []
+    for plugin_class in (DjangoLiveServerPlugin, CherryPyLiveServerPlugin):
+        plugin = plugin_class()
+        test = make_test({'start_live_server': True})
+
+        def run():
+            plugin.startTest(test)
+            # The server keeps running across tests, stop it like the end of
+            # the run does.
+            plugin.stop_server()
+            plugin.server_started = False
+
+        try:
+            timings = measure(run, iterations)
+        except ImportError:
+            continue
+        results.append(summarize('live_server', timings,
+                                 backend=plugin.name))
+    return results
+
+
+def bench_fixtures(iterations, sizes=(10, 100, 1000)):
+    """Loading `selenium_fixtures` of various sizes."""
+
+    from django.core.management import call_command
+    from noseselenium.plugins import SeleniumFixturesPlugin
+
+    call_command('syncdb', verbosity=0, interactive=False)
+
+    results = []
+    plugin = SeleniumFixturesPlugin()
+    for size in sizes:
+        fd, path = tempfile.mkstemp(suffix='.json')
+        fixture = os.fdopen(fd, 'w')
+        json.dump([{
+            'model': 'auth.user',
+            'pk': pk,
+            'fields': {
+                'username': 'user%d' % pk,
+                'password': '!',
+                'email': 'user%d@example.com' % pk,
+                'date_joined': '2011-01-01 00:00:00',
+                'last_login': '2011-01-01 00:00:00',
+            },
+        } for pk in range(1, size + 1)], fixture)
+        fixture.close()
+
+        test = make_test({'selenium_fixtures': [path]})
+        try:
+            timings = measure(lambda: plugin.startTest(test), iterations)
+        finally:
+            os.unlink(path)
+        results.append(summarize('fixtures', timings, objects=size))
+    return results
+
+
+def bench_command(iterations):
+    """Round trip of a single command against the fake server."""
+
+    from django.conf import settings
+    from noseselenium.client import SeleniumClient
+
+    sel = SeleniumClient(settings.SELENIUM_HOST, settings.SELENIUM_PORT,
+                         '*fake', settings.SELENIUM_URL_ROOT)
+    sel.start()
+    try:
+        timings = measure(sel.get_title, iterations)
+    finally:
+        sel.stop()
+    return [summarize('command_round_trip', timings)]
+
+
+def bench_string_array(iterations, sizes=(10, 100, 1000, 10000)):
+    """Parsing of string array responses, without the round trip."""
+
+    from noseselenium.client import SeleniumClient
+
+    results = []
+    for size in sizes:
+        csv = u','.join([u'item\\,%d' % i for i in range(size)])
+        sel = SeleniumClient('127.0.0.1', 0, '*fake', '')
+        sel.get_string = lambda verb, args: csv
+        timings = measure(lambda: sel.get_string_array('getAllLinks', []),
+                          iterations)
+        results.append(summarize('get_string_array', timings, items=size))
+    return results
+
+
+# Name, function and default number of iterations of each benchmark. The
+# order matters: live server starts reopen the in-memory database, so the
+# fixtures benchmark has to create its tables afterwards.
+BENCHMARKS = [
+    ('selenium_session', bench_selenium_session, 50),
+    ('live_server', bench_live_server, 3),
+    ('fixtures', bench_fixtures, 5),
+    ('command_round_trip', bench_command, 200),
+    ('get_string_array', bench_string_array, 20),
+]
+
+
+def main():
+    parser = OptionParser(usage="%prog [options] [benchmark ...]")
+    parser.add_option('-o', '--output', metavar='FILE',
+                      help="Write the results to FILE instead of stdout.")
+    parser.add_option('-n', '--iterations', type='int',
+                      help="Override the number of iterations.")
+    parser.add_option('--latency', type='float', default=0,
+                      help="Latency of the fake Selenium server in seconds.")
+    options, names = parser.parse_args()
+
+    from noseselenium.fakeserver import FakeSeleniumServer
+
+    server = FakeSeleniumServer(latency=options.latency)
+    server.start()
+    configure(server.port)
+
+    results = []
+    stdout = sys.stdout
+    # Keep the output of loaddata and friends out of the results.
+    sys.stdout = open(os.devnull, 'w')
+    try:
+        for name, func, iterations in BENCHMARKS:
+            if names and name not in names:
+                continue
+            results.extend(func(options.iterations or iterations))
+    finally:
+        sys.stdout.close()
+        sys.stdout = stdout
+        server.stop()
+
+    import django
+    report = {
+        'timestamp': datetime.datetime.utcnow().isoformat(),
+        'python': platform.python_version(),
+        'django': django.get_version(),
+        'fake_server_latency': options.latency,
+        'results': results,
+    }
+
+    if options.output:
+        output = open(options.output, 'w')
+    else:
+        output = sys.stdout
+    json.dump(report, output, indent=2, sort_keys=True)
+    output.write('\n')
+    if options.output:
+        output.close()
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,567 @@
+# -*- coding: utf-8 -*-
+"""
+noseselenium.asyncserver
+~~~~~~~~~~~~~~~~~~~~~~~~
+
+An event driven WSGI server for the live server plugin. A single thread
+runs an asyncore loop that accepts connections, parses the requests and
+writes the responses, while a small pool of worker threads runs the
+application. Connections are kept alive between requests, so the browser
+doesn't pay for a new connection per request, and idle connections don't
+tie up a thread. Static files are streamed by the loop itself.
+
+:copyright: 2010-2011, Pascal Hartig <phartig@weluse.de>
+:license: BSD, see LICENSE for more details.
+"""
+
+import os
+import sys
+import socket
+import mimetypes
+import urllib
+import asyncore
+import asynchat
+import logging
+import threading
+import Queue
+
+from cStringIO import StringIO
+from email.utils import formatdate, parsedate_tz, mktime_tz
+
+
+log = logging.getLogger('noseselenium.liveserver')
+
+# Largest request head accepted, to bound the memory of broken clients.
+MAX_HEADER_SIZE = 65536
+
+STATUS_LINES = {
+    200: '200 OK',
+    304: '304 Not Modified',
+    400: '400 Bad Request',
+    411: '411 Length Required',
+    500: '500 Internal Server Error',
+}
+
+
+def is_keep_alive(environ):
+    """Returns True if the connection of the request `environ` is kept
+    alive after the response.
+    """
+
+    connection = environ.get('HTTP_CONNECTION', '').lower()
+    if environ['SERVER_PROTOCOL'] == 'HTTP/1.1':
+        return connection != 'close'
+    return connection == 'keep-alive'
+
+
+def is_modified_since(header, mtime):
+    """Returns False if the ``If-Modified-Since`` header `header` is at or
+    after `mtime`.
+    """
+
+    if not header:
+        return True
+    parsed = parsedate_tz(header.split(';', 1)[0])
+    if parsed is None:
+        return True
+    return int(mtime) > mktime_tz(parsed)
+
+
+class FileWrapper(object):
+    """The ``wsgi.file_wrapper``: files returned through it are streamed by
+    the event loop instead of a worker thread.
+    """
+
+    def __init__(self, filelike, blksize=8192):
+        self.filelike = filelike
+        self.blksize = blksize
+
+    def __iter__(self):
+        return iter(lambda: self.filelike.read(self.blksize), '')
+
+    def close(self):
+        if hasattr(self.filelike, 'close'):
+            self.filelike.close()
+
+
+class FileProducer(object):
+    """An asynchat producer reading a :class:`FileWrapper` block by block,
+    chunk encoded if `chunked` is set.
+    """
+
+    def __init__(self, wrapper, chunked=False):
+        self.wrapper = wrapper
+        self.chunked = chunked
+        self.done = False
+
+    def more(self):
+        if self.done:
+            return ''
+        data = self.wrapper.filelike.read(self.wrapper.blksize)
+        if not data:
+            self.done = True
+            self.wrapper.close()
+            return self.chunked and '0\r\n\r\n' or ''
+        if self.chunked:
+            return '%x\r\n%s\r\n' % (len(data), data)
+        return data
+
+
+class Trigger(asyncore.dispatcher):
+    """Runs callables in the event loop on behalf of other threads, waking
+    the loop up through a socket pair.
+    """
+
+    def __init__(self, map):
+        self.lock = threading.Lock()
+        self.calls = []
+        sock, self.waker = socket.socketpair()
+        asyncore.dispatcher.__init__(self, sock, map)
+
+    def readable(self):
+        return True
+
+    def writable(self):
+        return False
+
+    def pull(self, call, *args):
+        """Schedules ``call(*args)`` in the event loop."""
+
+        with self.lock:
+            self.calls.append((call, args))
+        try:
+            self.waker.send('x')
+        except socket.error:
+            pass
+
+    def handle_read(self):
+        try:
+            self.recv(8192)
+        except socket.error:
+            pass
+        with self.lock:
+            calls, self.calls = self.calls, []
+        for call, args in calls:
+            try:
+                call(*args)
+            except Exception:
+                log.exception("Live server callback failed")
+
+    def handle_close(self):
+        self.close()
+
+    def close(self):
+        asyncore.dispatcher.close(self)
+        self.waker.close()
+
+
+class HTTPChannel(asynchat.async_chat):
+    """A client connection. Requests are parsed in the event loop and handed
+    to the worker threads one at a time, pipelined requests are queued.
+    """
+
+    def __init__(self, server, sock, address):
+        asynchat.async_chat.__init__(self, sock, map=server.map)
+        self.server = server
+        self.address = address
+        self.buffer = []
+        self.environ = None
+        self.content_length = 0
+        # Requests waiting for the current one to finish.
+        self.pending = []
+        self.busy = False
+        # Set once the connection is closed because of a bad request.
+        self.failed = False
+        self.set_terminator('\r\n\r\n')
+
+    def collect_incoming_data(self, data):
+        if self.failed:
+            return
+        self.buffer.append(data)
+        if self.environ is None and \
+           sum([len(chunk) for chunk in self.buffer]) > MAX_HEADER_SIZE:
+            self.send_error(400)
+
+    def found_terminator(self):
+        if self.failed:
+            return
+        data, self.buffer = ''.join(self.buffer), []
+        if self.environ is None:
+            try:
+                self.environ = self.server.parse_request(data, self.address)
+            except ValueError:
+                self.send_error(400)
+                return
+            if 'chunked' in self.environ.get('HTTP_TRANSFER_ENCODING', ''):
+                self.send_error(411)
+                return
+            self.content_length = int(self.environ.get('CONTENT_LENGTH') or
+                                      0)
+            if self.content_length > 0:
+                if self.environ.get('HTTP_EXPECT', '').lower() == \
+                   '100-continue':
+                    self.push('HTTP/1.1 100 Continue\r\n\r\n')
+                self.set_terminator(self.content_length)
+                return
+            data = ''
+
+        environ, self.environ = self.environ, None
+        environ['wsgi.input'] = StringIO(data)
+        self.set_terminator('\r\n\r\n')
+        self.pending.append(environ)
+        self.dispatch()
+
+    def dispatch(self):
+        """Serves the next pending request if it's a static file, or hands
+        it to the workers.
+        """
+
+        if not self.busy and self.pending and self.connected:
+            self.busy = True
+            environ = self.pending.pop(0)
+            if not self.server.serve_file(self, environ):
+                self.server.requests.put((self, environ))
+
+    def finish_response(self, keep_alive):
+        """Called in the loop once the worker wrote the whole response."""
+
+        self.busy = False
+        if not self.connected:
+            return
+        if keep_alive:
+            self.dispatch()
+        else:
+            self.close_when_done()
+
+    def send_error(self, code):
+        self.failed = True
+        self.push('HTTP/1.0 %s\r\nContent-Length: 0\r\n'
+                  'Connection: close\r\n\r\n' % STATUS_LINES[code])
+        self.close_when_done()
+        # Stops parsing the rest of the request.
+        self.set_terminator(None)
+
+    def push_data(self, data):
+        if self.connected:
+            self.push(data)
+
+    def push_producer(self, producer):
+        if self.connected:
+            self.push_with_producer(producer)
+
+    def handle_error(self):
+        log.debug("Live server connection error", exc_info=True)
+        self.close()
+
+
+class AsyncWSGIServer(asyncore.dispatcher):
+    """
+    Serves `application` on `address` with an event loop thread and
+    `threads` worker threads. The socket is bound right away, so address
+    errors are raised by the constructor.
+
+    `find_file` returns the static file to serve for a request path, or
+    None. Static files are streamed by the event loop without running
+    `application`.
+    """
+
+    def __init__(self, address, application, threads=10, find_file=None):
+        self.map = {}
+        asyncore.dispatcher.__init__(self, map=self.map)
+        self.application = application
+        self.threads = threads
+        self.find_file = find_file
+        self.requests = Queue.Queue()
+        self.workers = []
+        self.loop_thread = None
+        self.running = False
+
+        self.create_socket(socket.AF_INET, socket.SOCK_STREAM)
+        self.set_reuse_addr()
+        try:
+            self.bind(address)
+        except socket.error:
+            self.close()
+            raise
+        self.listen(128)
+        host, self.server_port = self.socket.getsockname()[:2]
+        self.server_name = socket.getfqdn(host)
+        self.trigger = Trigger(self.map)
+
+    def start(self):
+        """Starts the event loop and the workers."""
+
+        self.running = True
+        for i in range(self.threads):
+            worker = threading.Thread(target=self.work,
+                                      name='liveserver-worker-%d' % i)
+            worker.setDaemon(True)
+            worker.start()
+            self.workers.append(worker)
+        self.loop_thread = threading.Thread(target=self.loop,
+                                            name='liveserver-loop')
+        self.loop_thread.setDaemon(True)
+        self.loop_thread.start()
+
+    def stop(self, timeout=5):
+        """Closes all connections and waits for the threads to finish."""
+
+        self.running = False
+        self.trigger.pull(lambda: None)
+        if self.loop_thread is not None:
+            self.loop_thread.join(timeout)
+        for worker in self.workers:
+            self.requests.put(None)
+        for worker in self.workers:
+            worker.join(timeout)
+        self.workers = []
+
+    def loop(self):
+        while self.running:
+            asyncore.loop(timeout=1, use_poll=True, map=self.map, count=1)
+        for dispatcher in self.map.values():
+            try:
+                dispatcher.close()
+            except Exception:
+                pass
+
+    def handle_accept(self):
+        try:
+            pair = self.accept()
+        except socket.error:
+            return
+        if pair is not None:
+            HTTPChannel(self, *pair)
+
+    def handle_error(self):
+        log.exception("Live server error")
+
+    def parse_request(self, data, address):
+        """Returns the WSGI environ of the request head `data`. Raises
+        ValueError if it's malformed.
+        """
+
+        lines = data.split('\r\n')
+        method, uri, protocol = lines[0].split()
+        path, sep, query = uri.partition('?')
+        environ = {
+            'REQUEST_METHOD': method,
+            'SCRIPT_NAME': '',
+            'PATH_INFO': urllib.unquote(path),
+            'QUERY_STRING': query,
+            'SERVER_NAME': self.server_name,
+            'SERVER_PORT': str(self.server_port),
+            'SERVER_PROTOCOL': protocol,
+            'REMOTE_ADDR': address[0],
+            'REMOTE_HOST': '',
+            'GATEWAY_INTERFACE': 'CGI/1.1',
+            'CONTENT_LENGTH': '',
+            'wsgi.version': (1, 0),
+            'wsgi.url_scheme': 'http',
+            'wsgi.errors': sys.stderr,
+            'wsgi.multithread': True,
+            'wsgi.multiprocess': False,
+            'wsgi.run_once': False,
+            'wsgi.file_wrapper': FileWrapper,
+        }
+        for line in lines[1:]:
+            name, sep, value = line.partition(':')
+            if not sep:
+                raise ValueError("Malformed header: %r" % line)
+            name = name.strip().upper().replace('-', '_')
+            value = value.strip()
+            if name in ('CONTENT_TYPE', 'CONTENT_LENGTH'):
+                environ[name] = value
+            elif 'HTTP_' + name in environ:
+                environ['HTTP_' + name] += ',' + value
+            else:
+                environ['HTTP_' + name] = value
+        int(environ['CONTENT_LENGTH'] or 0)
+        return environ
+
+    def serve_file(self, channel, environ):
+        """Streams the static file requested by `environ` to `channel` from
+        the event loop. Returns False if it isn't a static file.
+        """
+
+        if self.find_file is None or \
+           environ['REQUEST_METHOD'] not in ('GET', 'HEAD'):
+            return False
+        filename = self.find_file(environ['PATH_INFO'])
+        if filename is None:
+            return False
+        try:
+            input = open(filename, 'rb')
+        except IOError:
+            return False
+
+        stat = os.fstat(input.fileno())
+        keep_alive = is_keep_alive(environ)
+        headers = [
+            ('Date', formatdate(usegmt=True)),
+            ('Last-Modified', formatdate(stat.st_mtime, usegmt=True)),
+            ('Connection', keep_alive and 'keep-alive' or 'close'),
+        ]
+        if not is_modified_since(environ.get('HTTP_IF_MODIFIED_SINCE'),
+                                 stat.st_mtime):
+            input.close()
+            status, body = STATUS_LINES[304], None
+        else:
+            content_type, encoding = mimetypes.guess_type(filename)
+            headers.append(('Content-Type',
+                            content_type or 'application/octet-stream'))
+            if encoding:
+                headers.append(('Content-Encoding', encoding))
+            headers.append(('Content-Length', str(stat.st_size)))
+            status, body = STATUS_LINES[200], FileWrapper(input)
+            if environ['REQUEST_METHOD'] == 'HEAD':
+                body.close()
+                body = None
+
+        lines = ['%s %s' % (environ['SERVER_PROTOCOL'], status)]
+        lines.extend(['%s: %s' % header for header in headers])
+        channel.push('\r\n'.join(lines) + '\r\n\r\n')
+        if body is not None:
+            channel.push_with_producer(FileProducer(body))
+        channel.finish_response(keep_alive)
+        return True
+
+    def work(self):
+        while True:
+            request = self.requests.get()
+            if request is None:
+                return
+            channel, environ = request
+            try:
+                self.handle_request(channel, environ)
+            except Exception:
+                log.exception("Live server request failed")
+                self.trigger.pull(channel.finish_response, False)
+
+    def handle_request(self, channel, environ):
+        """Runs the application and pushes the response to `channel`."""
+
+        protocol = environ['SERVER_PROTOCOL']
+        keep_alive = is_keep_alive(environ)
+
+        response = Response(self, channel, protocol, keep_alive,
+                            environ['REQUEST_METHOD'] == 'HEAD')
+        try:
+            result = self.application(environ, response.start_response)
+        except Exception:
+            log.exception("Live server application error")
+            response.fail()
+            return
+
+        if isinstance(result, FileWrapper):
+            response.send_file(result)
+            return
+
+        try:
+            for data in result:
+                response.write(data)
+        except Exception:
+            log.exception("Live server application error")
+            response.fail()
+            return
+        finally:
+            if hasattr(result, 'close'):
+                result.close()
+        response.finish()
+
+
+class Response(object):
+    """Formats the response of a single request and pushes it to the
+    channel through the event loop.
+    """
+
+    def __init__(self, server, channel, protocol, keep_alive, head=False):
+        self.server = server
+        self.channel = channel
+        self.protocol = protocol
+        self.keep_alive = keep_alive
+        self.status = None
+        self.headers = None
+        self.headers_sent = False
+        self.has_body = not head
+        self.chunked = False
+
+    def start_response(self, status, headers, exc_info=None):
+        if exc_info is not None:
+            try:
+                if self.headers_sent:
+                    raise exc_info[0], exc_info[1], exc_info[2]
+            finally:
+                exc_info = None
+        elif self.status is not None:
+            raise AssertionError("Headers already set.")
+        self.status = status
+        self.headers = list(headers)
+        return self.write
+
+    def push(self, data):
+        self.server.trigger.pull(self.channel.push_data, data)
+
+    def send_headers(self):
+        # Informational, 204 and 304 responses never have a body, so they
+        # are neither chunked nor terminated.
+        code = int(self.status.split(None, 1)[0])
+        if code < 200 or code in (204, 304):
+            self.has_body = False
+
+        names = [name.lower() for name, value in self.headers]
+        if 'content-length' not in names and self.has_body:
+            if self.protocol == 'HTTP/1.1':
+                self.chunked = True
+                self.headers.append(('Transfer-Encoding', 'chunked'))
+            else:
+                self.keep_alive = False
+        if 'date' not in names:
+            self.headers.append(('Date', formatdate(usegmt=True)))
+        self.headers.append(('Connection',
+                             self.keep_alive and 'keep-alive' or 'close'))
+
+        lines = ['%s %s' % (self.protocol, self.status)]
+        lines.extend(['%s: %s' % header for header in self.headers])
+        self.push('\r\n'.join(lines) + '\r\n\r\n')
+        self.headers_sent = True
+
+    def write(self, data):
+        if self.status is None:
+            raise AssertionError("write() before start_response()")
+        if not self.headers_sent:
+            self.send_headers()
+        if not data or not self.has_body:
+            return
+        if self.chunked:
+            data = '%x\r\n%s\r\n' % (len(data), data)
+        self.push(data)
+
+    def send_file(self, wrapper):
+        if not self.headers_sent:
+            self.send_headers()
+        if not self.has_body:
+            wrapper.close()
+        else:
+            self.server.trigger.pull(self.channel.push_producer,
+                                     FileProducer(wrapper, self.chunked))
+        self.server.trigger.pull(self.channel.finish_response,
+                                 self.keep_alive)
+
+    def finish(self):
+        if not self.headers_sent:
+            self.send_headers()
+        if self.chunked:
+            self.push('0\r\n\r\n')
+        self.server.trigger.pull(self.channel.finish_response,
+                                 self.keep_alive)
+
+    def fail(self):
+        """Sends an error page if nothing was sent yet, closes the
+        connection in any case.
+        """
+
+        if not self.headers_sent:
+            self.push('%s %s\r\nContent-Length: 0\r\nConnection: close\r\n'
+                      '\r\n' % (self.protocol, STATUS_LINES[500]))
+        self.server.trigger.pull(self.channel.finish_response, False)
@@ -26,6 +26,22 @@ class SeleniumTestCaseMixin(object):
     """
     Provides a selenium attribute that raises :class:`SkipTest`
     when not overwritten by :class:`SeleniumPlugin`.
+
+    The `selenium_*` options override the settings for the tests of the
+    class, unless they are None:
+
+    * `selenium_browser_command`: a browser command or a list of them,
+      instead of `SELENIUM_BROWSER_COMMAND` or `SELENIUM_BROWSER_COMMANDS`.
+    * `selenium_url_root`: instead of `SELENIUM_URL_ROOT`.
+    * `selenium_session_scope`: ``'test'``, ``'class'`` or ``'run'``, how
+      long the session is kept, instead of `SELENIUM_REUSE_SESSIONS`.
+    * `selenium_fixtures_scope`: instead of `SELENIUM_FIXTURES_SCOPE`.
+    * `selenium_speed`: milliseconds to wait after each command, instead of
+      `SELENIUM_SPEED`.
+    * `selenium_timeout`: milliseconds to wait for pages and ``waitFor``
+      commands, instead of `SELENIUM_TIMEOUT`.
+
+    The options are read once per class.
     """
 
     # To be replaced by the plugin.
@@ -33,3 +49,39 @@ class SeleniumTestCaseMixin(object):
     # Triggers the plugin if enabled.
     selenium_test = True
     start_live_server = True
+    # Data builders by name, see :func:`requires_data`.
+    selenium_data = {}
+    # Per class options.
+    selenium_browser_command = None
+    selenium_url_root = None
+    selenium_session_scope = None
+    selenium_fixtures_scope = None
+    selenium_speed = None
+    selenium_timeout = None
+
+
+def requires_data(*names):
+    """
+    Marks a test method or a whole test class as needing the data `names`
+    of `selenium_data`. The fixtures plugin builds the data before the test
+    and sets it as the `selenium_objects` dict of the test case::
+
+        class UserTest(TestCase, SeleniumTestCaseMixin):
+            selenium_data = {
+                'user': lambda data: User.objects.create_user(
+                    'pascal', 'pascal@example.com', 'iwantapony'),
+            }
+
+            @requires_data('user')
+            def test_login(self):
+                user = self.selenium_objects['user']
+
+    Builders get the data of the test as argument, so that they can look
+    up the data they depend on.
+    """
+
+    def decorator(test):
+        test.required_data = tuple(getattr(test, 'required_data', ())) + \
+                names
+        return test
+    return decorator
@@ -0,0 +1,511 @@
+# -*- coding: utf-8 -*-
+"""
+noseselenium.client
+~~~~~~~~~~~~~~~~~~~
+
+Extensions to the generated selenium RC client.
+
+:copyright: 2010-2011, Pascal Hartig <phartig@weluse.de>
+:license: BSD, see LICENSE for more details.
+"""
+
+import sys
+import time
+import socket
+import threading
+
+from timeit import default_timer
+
+from noseselenium.thirdparty.selenium import selenium
+
+
+# Commands whose leading arguments are element locators that must point to an
+# existing element. Presence checks like `isElementPresent` are left out on
+# purpose, because they are expected to be re-evaluated.
+LOCATOR_VERBS = frozenset([
+    'click', 'doubleClick', 'contextMenu', 'clickAt', 'doubleClickAt',
+    'contextMenuAt', 'fireEvent', 'focus', 'keyPress', 'keyDown', 'keyUp',
+    'mouseOver', 'mouseOut', 'mouseDown', 'mouseDownRight', 'mouseDownAt',
+    'mouseDownRightAt', 'mouseUp', 'mouseUpRight', 'mouseUpAt',
+    'mouseUpRightAt', 'mouseMove', 'mouseMoveAt', 'type', 'typeKeys',
+    'check', 'uncheck', 'select', 'addSelection', 'removeSelection',
+    'removeAllSelections', 'submit', 'getValue', 'getText', 'highlight',
+    'isChecked', 'getSelectedLabels', 'getSelectedLabel',
+    'getSelectedValues', 'getSelectedValue', 'getSelectedIndexes',
+    'getSelectedIndex', 'getSelectedIds', 'getSelectedId',
+    'isSomethingSelected', 'getSelectOptions', 'isVisible', 'isEditable',
+    'dragdrop', 'dragAndDrop', 'dragAndDropToObject', 'setCursorPosition',
+    'getElementIndex', 'isOrdered', 'getElementPositionLeft',
+    'getElementPositionTop', 'getElementWidth', 'getElementHeight',
+    'getCursorPosition', 'attachFile',
+])
+
+# Number of leading arguments of a command in `LOCATOR_VERBS` that are
+# locators. Defaults to one.
+LOCATOR_ARGUMENTS = {
+    'dragAndDropToObject': 2,
+    'isOrdered': 2,
+}
+
+# Commands after which the document, and therefore every assigned id, may
+# have been replaced. Clicks that navigate are covered by the
+# `waitForPageToLoad` that has to follow them.
+NAVIGATION_VERBS = frozenset([
+    'open', 'refresh', 'goBack', 'waitForPageToLoad', 'waitForFrameToLoad',
+    'waitForPopUp', 'openWindow', 'selectWindow', 'selectPopUp',
+    'deselectPopUp', 'selectFrame', 'close', 'submit',
+])
+
+# Commands that only read the state of the page. Every other command is
+# considered to mutate it. Alerts, confirmations and prompts are consumed
+# when read and therefore left out.
+READ_ONLY_VERBS = frozenset([
+    'getLocation', 'getTitle', 'getBodyText', 'getValue', 'getText',
+    'isChecked', 'getTable', 'getSelectedLabels', 'getSelectedLabel',
+    'getSelectedValues', 'getSelectedValue', 'getSelectedIndexes',
+    'getSelectedIndex', 'getSelectedIds', 'getSelectedId',
+    'isSomethingSelected', 'getSelectOptions', 'getAttribute',
+    'isTextPresent', 'isElementPresent', 'isVisible', 'isEditable',
+    'getAllButtons', 'getAllLinks', 'getAllFields',
+    'getAttributeFromAllWindows', 'getAllWindowIds', 'getAllWindowNames',
+    'getAllWindowTitles', 'getHtmlSource', 'getElementIndex', 'isOrdered',
+    'getElementPositionLeft', 'getElementPositionTop', 'getElementWidth',
+    'getElementHeight', 'getCursorPosition', 'getXpathCount', 'getCookie',
+    'getCookieByName', 'isCookiePresent',
+])
+
+# Commands whose duration depends on the application or the test instead of
+# the health of the session. They don't count towards the latency.
+UNTIMED_VERBS = frozenset([
+    'getNewBrowserSession', 'testComplete', 'open', 'openWindow',
+    'waitForPageToLoad', 'waitForFrameToLoad', 'waitForPopUp',
+    'waitForCondition', 'setSpeed', 'captureScreenshot',
+    'captureEntirePageScreenshot', 'captureScreenshotToString',
+    'captureEntirePageScreenshotToString', 'shutDownSeleniumServer',
+])
+
+# Commands whose results are expected to differ between browsers.
+UNCOMPARED_VERBS = frozenset([
+    'getNewBrowserSession', 'testComplete', 'getHtmlSource', 'getEval',
+    'getExpression', 'getAllWindowIds', 'getAllWindowNames',
+    'getAllWindowTitles', 'getElementPositionLeft', 'getElementPositionTop',
+    'getElementWidth', 'getElementHeight', 'getCursorPosition',
+    'captureScreenshotToString', 'captureEntirePageScreenshotToString',
+    'retrieveLastRemoteControlLogs',
+])
+
+# Resets the browser in a single round trip. Evaluated by `getEval`, where
+# `this` is the selenium core instance.
+RESET_SCRIPT = """(function(selenium) {
+    var bot = selenium.browserbot, closed = 0, name, win;
+    selenium.doDeselectPopUp();
+    selenium.doDeleteAllVisibleCookies();
+    win = bot.getCurrentWindow();
+    try { win.localStorage.clear(); } catch (e) {}
+    try { win.sessionStorage.clear(); } catch (e) {}
+    for (name in bot.openedWindows) {
+        try { bot.openedWindows[name].close(); closed++; } catch (e) {}
+    }
+    bot.openedWindows = {};
+    return closed;
+})(this);"""
+
+# Locator prefixes that are evaluated by walking the document.
+EXPENSIVE_LOCATOR_PREFIXES = ('xpath=', '//', 'css=', 'dom=', 'document.')
+
+
+def is_expensive_locator(locator):
+    """Returns True for locators that are worth resolving only once."""
+
+    return isinstance(locator, basestring) and \
+            locator.startswith(EXPENSIVE_LOCATOR_PREFIXES)
+
+
+class SessionStats(object):
+    """
+    Number of commands, age and latency of a browser session. The mean
+    latency of the first `baseline_commands` commands serves as baseline, an
+    exponential moving average tracks the recent latency.
+    """
+
+    def __init__(self, baseline_commands=50, smoothing=0.05):
+        self.baseline_commands = baseline_commands
+        self.smoothing = smoothing
+        self.started = time.time()
+        self.commands = 0
+        self.latency = 0.0
+        self.baseline = None
+        self.recent = None
+
+    def add(self, latency):
+        """Records the latency of a single command."""
+
+        self.commands += 1
+        self.latency += latency
+        if self.recent is None:
+            self.recent = latency
+        else:
+            self.recent += self.smoothing * (latency - self.recent)
+        if self.baseline is None and self.commands >= self.baseline_commands:
+            self.baseline = self.latency / self.commands
+
+    @property
+    def age(self):
+        return time.time() - self.started
+
+    @property
+    def mean_latency(self):
+        return self.commands and self.latency / self.commands or 0.0
+
+    @property
+    def drift(self):
+        """Ratio of the recent latency to the baseline, if known."""
+
+        if not self.baseline:
+            return None
+        return self.recent / self.baseline
+
+    def check(self, max_commands=None, max_age=None, max_drift=None):
+        """Returns why the session should be recycled or None if it is
+        healthy.
+        """
+
+        if max_commands is not None and self.commands >= max_commands:
+            return "%d commands sent" % self.commands
+        if max_age is not None and self.age >= max_age:
+            return "%.0f seconds old" % self.age
+        drift = self.drift
+        if max_drift is not None and drift is not None and \
+           drift >= max_drift:
+            return "latency %.1f times the baseline" % drift
+        return None
+
+
+class SeleniumClient(selenium):
+    """
+    Selenium RC client with optional, opt-in optimizations.
+
+    With `cache_locators` enabled, expensive element locators (XPath, CSS
+    and DOM expressions) are resolved once per page: the element is tagged
+    with `assign_id` and later commands using the same locator are rewritten
+    to the cheap ``id=`` form. The cache is dropped whenever the page may
+    have changed, see :data:`NAVIGATION_VERBS`. Elements replaced by
+    javascript without a page load keep their stale mapping, so only enable
+    the cache for pages that don't rebuild their DOM.
+
+    With `cache_getters` enabled, the results of read-only commands (see
+    :data:`READ_ONLY_VERBS`) are memoized until any other command is sent.
+    Loops polling a getter until the page changes by itself must call
+    :meth:`clear_getter_cache` or use `wait_for_condition` instead.
+
+    If :attr:`trace` is set to a :class:`~noseselenium.trace.CommandTrace`,
+    every command sent to the server is recorded to it.
+
+    While a session is running, :attr:`stats` holds its
+    :class:`SessionStats`.
+
+    If a :class:`~noseselenium.nodes.NodePool` is given as `node_pool`,
+    `host` and `port` are ignored and the session is started on the node the
+    pool assigns. Nodes refusing the session are marked dead and the next
+    one is tried. The node is kept in :attr:`node` until the session stops.
+    """
+
+    locator_id_prefix = 'noseselenium-'
+
+    def __init__(self, host, port, browserStartCommand, browserURL,
+                 cache_locators=False, cache_getters=False, node_pool=None):
+        selenium.__init__(self, host, port, browserStartCommand, browserURL)
+        self.cache_locators = cache_locators
+        self.cache_getters = cache_getters
+        self.getter_cache_hits = 0
+        self.getter_cache_misses = 0
+        self._locator_cache = {}
+        self._locator_counter = 0
+        self._getter_cache = {}
+        self.trace = None
+        self.stats = None
+        self.node_pool = node_pool
+        self.node = None
+
+    def start(self):
+        if self.node_pool is None:
+            selenium.start(self)
+        else:
+            self._start_on_node()
+        self.stats = SessionStats()
+
+    def stop(self):
+        try:
+            selenium.stop(self)
+        finally:
+            if self.node is not None:
+                if self.stats is not None and self.stats.commands:
+                    self.node_pool.record_latency(self.node,
+                                                  self.stats.mean_latency)
+                self.node_pool.release(self.node)
+                self.node = None
+            self.stats = None
+
+    def _start_on_node(self):
+        """Starts the session on the first node of the pool accepting it."""
+
+        while True:
+            node = self.node_pool.acquire()
+            self.host, self.port = node.host, node.port
+            try:
+                selenium.start(self)
+            except socket.error:
+                self.node_pool.release(node)
+                self.node_pool.mark_dead(node)
+            except Exception:
+                self.node_pool.release(node)
+                raise
+            else:
+                self.node = node
+                return
+
+    def reset(self, url='about:blank'):
+        """
+        Brings the browser back to a clean state without starting a new
+        session: deletes the visible cookies, clears the local and session
+        storage, closes all windows but the main one and opens `url`.
+
+        The cleanup is done by a single script. If that fails, e.g. because
+        the browser's selenium core differs, the same steps are done with
+        separate commands.
+        """
+
+        try:
+            self.get_eval(RESET_SCRIPT)
+        except Exception:
+            self._reset_stepwise()
+        self.open(url)
+
+    def _reset_stepwise(self):
+        self.deselect_pop_up()
+        self.delete_all_visible_cookies()
+        self.run_script("try { localStorage.clear(); } catch (e) {}"
+                        "try { sessionStorage.clear(); } catch (e) {}")
+        # The main window comes first. Window names are used instead of ids,
+        # because most pages don't set the id of their windows.
+        for name in self.get_all_window_names()[1:]:
+            if name:
+                self.select_window(name)
+                self.close()
+        self.select_window('null')
+
+    def clear_locator_cache(self):
+        """Forgets all locators resolved so far."""
+
+        self._locator_cache.clear()
+
+    def clear_getter_cache(self):
+        """Forgets all memoized getter results."""
+
+        self._getter_cache.clear()
+
+    def do_command(self, verb, args):
+        if not self.cache_getters:
+            return self._do_command(verb, args)
+
+        if verb not in READ_ONLY_VERBS:
+            self.clear_getter_cache()
+            return self._do_command(verb, args)
+
+        key = (verb, tuple(args))
+        try:
+            result = self._getter_cache[key]
+        except KeyError:
+            self.getter_cache_misses += 1
+            result = self._getter_cache[key] = self._do_command(verb, args)
+        else:
+            self.getter_cache_hits += 1
+        return result
+
+    def _do_command(self, verb, args):
+        """Sends a command to the server, applying the locator cache."""
+
+        if self.cache_locators and verb in LOCATOR_VERBS:
+            args = self._resolve_locators(verb, args)
+
+        try:
+            return self._send(verb, args)
+        finally:
+            if verb in NAVIGATION_VERBS:
+                self.clear_locator_cache()
+
+    def _send(self, verb, args):
+        """Sends a single command over the wire."""
+
+        start = default_timer()
+        ok = False
+        try:
+            result = selenium.do_command(self, verb, args)
+            ok = True
+            return result
+        finally:
+            duration = default_timer() - start
+            if self.stats is not None and verb not in UNTIMED_VERBS:
+                self.stats.add(duration)
+            if self.trace is not None:
+                self.trace.record(verb, args, start, duration, ok)
+
+    def _resolve_locators(self, verb, args):
+        """Replaces expensive locators in `args` by their assigned id."""
+
+        args = list(args)
+        for i in range(min(LOCATOR_ARGUMENTS.get(verb, 1), len(args))):
+            if is_expensive_locator(args[i]):
+                args[i] = self._resolve_locator(args[i])
+        return args
+
+    def _resolve_locator(self, locator):
+        """Returns the cheap form of `locator`: the id of the element, which
+        is assigned on first use if the element has none. Falls back to the
+        original locator if the element can't be tagged, so the actual
+        command reports the error.
+        """
+
+        try:
+            return self._locator_cache[locator]
+        except KeyError:
+            pass
+
+        # Scripts and styles of the page may rely on the existing id.
+        try:
+            identifier = self._send("getAttribute", [locator + '@id'])[3:]
+        except Exception:
+            identifier = None
+
+        if not identifier:
+            self._locator_counter += 1
+            identifier = '%s%d' % (self.locator_id_prefix,
+                                   self._locator_counter)
+            try:
+                self._send("assignId", [locator, identifier])
+            except Exception:
+                return locator
+
+            # The new id is visible to getters.
+            self.clear_getter_cache()
+
+        self._locator_cache[locator] = 'id=' + identifier
+        return self._locator_cache[locator]
+
+
+def call_concurrently(calls):
+    """
+    Runs the callables in `calls` concurrently, the first one in the current
+    thread. Returns a ``(result, exc_info)`` tuple per callable.
+    """
+
+    results = [None] * len(calls)
+
+    def run(index):
+        try:
+            results[index] = (calls[index](), None)
+        except Exception:
+            results[index] = (None, sys.exc_info())
+
+    threads = [threading.Thread(target=run, args=(index,))
+               for index in range(1, len(calls))]
+    for thread in threads:
+        thread.start()
+    run(0)
+    for thread in threads:
+        thread.join()
+    return results
+
+
+class BrowserMismatch(AssertionError):
+    """Raised if browsers of a :class:`BrowserMatrix` disagree."""
+
+
+class BrowserMatrix(SeleniumClient):
+    """
+    Drives a session per browser at once. Every command is sent to all
+    sessions concurrently and the result of the first one is returned, so
+    the test runs against all browsers without running it once per browser.
+
+    If a browser fails, the error is raised with the browser's start command.
+    With `compare_results` enabled, differing results raise a
+    :class:`BrowserMismatch`, except for commands whose results are expected
+    to differ (see :data:`UNCOMPARED_VERBS`).
+    """
+
+    def __init__(self, clients, compare_results=True):
+        primary = clients[0]
+        SeleniumClient.__init__(self, primary.host, primary.port,
+                                primary.browserStartCommand,
+                                primary.browserURL)
+        self.clients = list(clients)
+        self.compare_results = compare_results
+
+    @property
+    def browsers(self):
+        return [client.browserStartCommand for client in self.clients]
+
+    def start(self):
+        results = call_concurrently([client.start
+                                     for client in self.clients])
+        errors = [(client, exc_info) for client, (result, exc_info)
+                  in zip(self.clients, results) if exc_info is not None]
+        if errors:
+            for client, (result, exc_info) in zip(self.clients, results):
+                if exc_info is None:
+                    try:
+                        client.stop()
+                    except Exception:
+                        pass
+            self._raise(*errors[0])
+        self.sessionId = ','.join([client.sessionId
+                                   for client in self.clients])
+        # Health checks look at the first browser.
+        self.stats = self.clients[0].stats
+
+    def stop(self):
+        results = call_concurrently([client.stop for client in self.clients])
+        self.sessionId = None
+        self.stats = None
+        for client, (result, exc_info) in zip(self.clients, results):
+            if exc_info is not None:
+                self._raise(client, exc_info)
+
+    def do_command(self, verb, args):
+        start = default_timer()
+        ok = False
+        try:
+            results = call_concurrently([
+                lambda client=client: client.do_command(verb, args)
+                for client in self.clients])
+            for client, (result, exc_info) in zip(self.clients, results):
+                if exc_info is not None:
+                    self._raise(client, exc_info)
+
+            if self.compare_results and verb not in UNCOMPARED_VERBS:
+                self._compare(verb, args, results)
+            ok = True
+            return results[0][0]
+        finally:
+            if self.trace is not None:
+                self.trace.record(verb, args, start,
+                                  default_timer() - start, ok)
+
+    def _compare(self, verb, args, results):
+        values = [result for result, exc_info in results]
+        if values.count(values[0]) != len(values):
+            raise BrowserMismatch("Browsers disagree on %s(%s): %s" % (
+                verb, ', '.join([repr(arg) for arg in args]), ', '.join([
+                    '%s returned %r' % (client.browserStartCommand,
+                                        value[3:])
+                    for client, value in zip(self.clients, values)])))
+
+    def _raise(self, client, exc_info):
+        """Re-raises the error of a client, naming its browser."""
+
+        exc_type, exc_value, traceback = exc_info
+        if type(exc_value) is Exception:
+            # Errors reported by the Selenium server.
+            exc_value = Exception("%s: %s" % (client.browserStartCommand,
+                                               exc_value))
+        raise type(exc_value), exc_value, traceback
@@ -0,0 +1,106 @@
+# -*- coding: utf-8 -*-
+"""
+noseselenium.data
+~~~~~~~~~~~~~~~~~
+
+Lazily built test data: test classes name builders in `selenium_data` and
+tests only get the data they ask for with
+:func:`~noseselenium.cases.requires_data`.
+
+:copyright: 2010-2011, Pascal Hartig <phartig@weluse.de>
+:license: BSD, see LICENSE for more details.
+"""
+
+import logging
+
+from noseselenium.database import atomic, connect_flush_receiver
+
+
+log = logging.getLogger('noseselenium')
+
+
+class DataRequest(object):
+    """
+    The data available to the builders of a single test. Looking up a name
+    builds the data unless it was built before. Builders are called with
+    the request, so they can look up the data they depend on.
+    """
+
+    def __init__(self, registry, builders):
+        self.registry = registry
+        self.builders = builders
+        # Names being built, to detect cycles.
+        self._building = []
+
+    def __getitem__(self, name):
+        try:
+            builder = self.builders[name]
+        except KeyError:
+            raise KeyError("No selenium data builder named '%s'." % name)
+
+        results = self.registry.results
+        if builder in results:
+            return results[builder]
+
+        if name in self._building:
+            raise ValueError("Circular selenium data: %s" % ' -> '.join(
+                self._building[self._building.index(name):] + [name]))
+
+        self._building.append(name)
+        try:
+            log.debug("Building selenium data '%s'.", name)
+            result = results[builder] = builder(self)
+        finally:
+            self._building.pop()
+        self.registry.built.append(builder)
+        return result
+
+
+class DataRegistry(object):
+    """
+    Memoizes the results of the builders, so that every builder is called
+    once until the test database is flushed. Builders are identified by
+    themselves rather than by their names, so classes sharing a builder
+    share its data.
+    """
+
+    def __init__(self):
+        self.results = {}
+        # Builders called by the current :meth:`build`.
+        self.built = []
+        self.connected = False
+
+    def connect(self):
+        """Forgets the data whenever the database is flushed."""
+
+        if self.connected:
+            return
+        connect_flush_receiver(self.reset)
+        self.connected = True
+
+    def reset(self, **kwargs):
+        self.results.clear()
+
+    def build(self, builders, names, using=None):
+        """
+        Builds the data `names` from `builders` and their dependencies and
+        commits it, so that the live server can see it. Returns the data of
+        `names` by name.
+        """
+
+        request = DataRequest(self, builders)
+        self.built = []
+        try:
+            with atomic(using):
+                data = dict([(name, request[name]) for name in names])
+        except Exception:
+            # The rows of the builders are rolled back.
+            for builder in self.built:
+                self.results.pop(builder, None)
+            raise
+        finally:
+            self.built = []
+        return data
+
+
+registry = DataRegistry()
@@ -0,0 +1,397 @@
+# -*- coding: utf-8 -*-
+"""
+noseselenium.database
+~~~~~~~~~~~~~~~~~~~~~
+
+Cloning of the test database, so that parallel workers don't share it.
+SQLite databases are copied, PostgreSQL databases are created with the test
+database as template and MySQL databases are dumped and restored.
+
+Keeping the test database across runs, as long as the models and
+migrations don't change.
+
+Transactions and flush notifications working across django versions.
+
+:copyright: 2010-2011, Pascal Hartig <phartig@weluse.de>
+:license: BSD, see LICENSE for more details.
+"""
+
+import os
+import json
+import time
+import shutil
+import hashlib
+import logging
+import subprocess
+
+from contextlib import contextmanager
+from django.utils.importlib import import_module
+
+from noseselenium.fixtures import get_fixtures_hash
+
+
+log = logging.getLogger('noseselenium')
+
+
+# Database the PostgreSQL statements are run on, as a database can neither
+# be dropped nor used as template while being connected to it.
+POSTGRESQL_MAINTENANCE_DB = 'postgres'
+
+
+class DatabaseCloneError(Exception):
+    """Raised if a test database can't be cloned."""
+
+
+def connect_flush_receiver(receiver):
+    """Connects `receiver` to the signal django sends after a database was
+    created or flushed: ``post_syncdb``, or ``post_migrate`` on newer
+    versions.
+    """
+
+    try:
+        from django.db.models.signals import post_syncdb as signal
+    except ImportError:
+        from django.db.models.signals import post_migrate as signal
+    signal.connect(receiver, weak=False)
+
+
+@contextmanager
+def atomic(using=None):
+    """
+    Runs the block in a transaction on the database `using`, which is
+    committed unless the block raises. Uses ``transaction.atomic`` or
+    ``commit_on_success`` before django 1.6.
+    """
+
+    from django.db import transaction, DEFAULT_DB_ALIAS
+
+    using = using or DEFAULT_DB_ALIAS
+    if hasattr(transaction, 'atomic'):
+        with transaction.atomic(using=using):
+            yield
+    else:
+        with transaction.commit_on_success(using=using):
+            yield
+            # Raw SQL doesn't mark the transaction dirty, so it wouldn't be
+            # committed.
+            transaction.set_dirty(using=using)
+
+
+def set_autocommit(connection):
+    """Make sure a connection is in autocommit mode."""
+
+    if hasattr(connection.connection, "autocommit"):
+        if callable(connection.connection.autocommit):
+            connection.connection.autocommit(True)
+        else:
+            connection.connection.autocommit = True
+    elif hasattr(connection.connection, "set_isolation_level"):
+        connection.connection.set_isolation_level(0)
+
+
+def get_clone_name(connection, name, suffix):
+    """Returns the name of the clone `suffix` of the database `name`."""
+
+    if connection.vendor == 'sqlite':
+        root, ext = os.path.splitext(name)
+        return '%s_%s%s' % (root, suffix, ext)
+    return '%s_%s' % (name, suffix)
+
+
+def clone_test_db(connection, source, target):
+    """
+    Replaces the database `target` with a copy of `source`. The connection
+    must not be connected to either of them.
+    """
+
+    if connection.vendor == 'sqlite':
+        if source == ':memory:' or source.startswith('file:'):
+            raise DatabaseCloneError("In-memory databases can't be cloned.")
+        shutil.copyfile(source, target)
+    elif connection.vendor == 'postgresql':
+        qn = connection.ops.quote_name
+        # Fails while another session is connected to the template, e.g.
+        # a worker cloning it at the same time.
+        for attempt in range(5):
+            try:
+                _execute_maintenance(connection, [
+                    'DROP DATABASE IF EXISTS %s' % qn(target),
+                    'CREATE DATABASE %s TEMPLATE %s' % (qn(target),
+                                                        qn(source)),
+                ])
+                return
+            except Exception as e:
+                error = e
+                time.sleep(1)
+        raise DatabaseCloneError("Couldn't clone %s: %s" % (source, error))
+    elif connection.vendor == 'mysql':
+        _clone_mysql(connection, source, target)
+    else:
+        raise DatabaseCloneError("Cloning %s databases isn't supported."
+                                 % connection.vendor)
+
+
+def drop_test_db(connection, name):
+    """Removes the database `name` created by :func:`clone_test_db`."""
+
+    connection.close()
+    if connection.vendor == 'sqlite':
+        if os.path.exists(name):
+            os.remove(name)
+    elif connection.vendor == 'postgresql':
+        _execute_maintenance(connection, [
+            'DROP DATABASE IF EXISTS %s' % connection.ops.quote_name(name)])
+    elif connection.vendor == 'mysql':
+        _execute(connection, [
+            'DROP DATABASE IF EXISTS %s' % connection.ops.quote_name(name)])
+
+
+def _execute(connection, statements):
+    """Runs `statements` in autocommit mode and closes the connection."""
+
+    try:
+        cursor = connection.cursor()
+        set_autocommit(connection)
+        for statement in statements:
+            cursor.execute(statement)
+    finally:
+        connection.close()
+
+
+def _execute_maintenance(connection, statements):
+    """Runs `statements` connected to the maintenance database."""
+
+    name = connection.settings_dict['NAME']
+    connection.close()
+    connection.settings_dict['NAME'] = POSTGRESQL_MAINTENANCE_DB
+    try:
+        _execute(connection, statements)
+    finally:
+        connection.settings_dict['NAME'] = name
+
+
+def _get_mysql_args(settings_dict):
+    """Returns the connection arguments for the mysql command line tools."""
+
+    args = []
+    if settings_dict['USER']:
+        args.append('--user=%s' % settings_dict['USER'])
+    if settings_dict['PASSWORD']:
+        args.append('--password=%s' % settings_dict['PASSWORD'])
+    if settings_dict['HOST']:
+        if settings_dict['HOST'].startswith('/'):
+            args.append('--socket=%s' % settings_dict['HOST'])
+        else:
+            args.append('--host=%s' % settings_dict['HOST'])
+    if settings_dict['PORT']:
+        args.append('--port=%s' % settings_dict['PORT'])
+    return args
+
+
+def _clone_mysql(connection, source, target):
+    qn = connection.ops.quote_name
+    _execute(connection, ['DROP DATABASE IF EXISTS %s' % qn(target),
+                          'CREATE DATABASE %s' % qn(target)])
+
+    args = _get_mysql_args(connection.settings_dict)
+    dump = subprocess.Popen(['mysqldump', '--routines'] + args + [source],
+                            stdout=subprocess.PIPE)
+    load = subprocess.Popen(['mysql'] + args + [target], stdin=dump.stdout)
+    # Lets mysqldump receive a SIGPIPE if mysql exits early.
+    dump.stdout.close()
+    load.wait()
+    dump.wait()
+
+    if dump.returncode or load.returncode:
+        raise DatabaseCloneError(
+            "Couldn't clone %s: mysqldump exited with %d, mysql with %d."
+            % (source, dump.returncode, load.returncode))
+
+
+def _iter_schema_files(app):
+    """Yields the source files of the models and migrations of `app`."""
+
+    directory = os.path.dirname(import_module(app).__file__)
+    for name in ('models', 'migrations'):
+        path = os.path.join(directory, name)
+        if os.path.isfile(path + '.py'):
+            yield path + '.py'
+        for root, dirs, files in os.walk(path):
+            dirs.sort()
+            for filename in sorted(files):
+                if filename.endswith('.py'):
+                    yield os.path.join(root, filename)
+
+
+_schema_fingerprint = None
+
+
+def get_schema_fingerprint():
+    """Returns a hash of the django version and the sources of the models
+    and migrations of all installed apps. The sources don't change during a
+    run, so the hash is computed once per process.
+    """
+
+    global _schema_fingerprint
+
+    if _schema_fingerprint is None:
+        _schema_fingerprint = _compute_schema_fingerprint()
+    return _schema_fingerprint
+
+
+def _compute_schema_fingerprint():
+    import django
+    from django.conf import settings
+
+    digest = hashlib.sha1(django.get_version())
+    for app in settings.INSTALLED_APPS:
+        digest.update(app)
+        for path in _iter_schema_files(app):
+            digest.update(path)
+            input = open(path, 'rb')
+            try:
+                digest.update(input.read())
+            finally:
+                input.close()
+    return digest.hexdigest()
+
+
+def _database_exists(connection, name):
+    if connection.vendor == 'sqlite':
+        return name != ':memory:' and os.path.exists(name)
+
+    old_name = connection.settings_dict['NAME']
+    connection.close()
+    connection.settings_dict['NAME'] = name
+    try:
+        connection.cursor()
+    except Exception:
+        return False
+    finally:
+        connection.close()
+        connection.settings_dict['NAME'] = old_name
+    return True
+
+
+class TestDatabaseKeeper(object):
+    """
+    Keeps the test databases after the run and reuses them in the next run
+    if the schema fingerprint didn't change. The fingerprints and the
+    hashes of the fixtures loaded into the kept databases are stored in a
+    JSON state file.
+
+    :meth:`install` replaces `create_test_db` and `destroy_test_db` of the
+    connections, so it has to be called before the test runner creates the
+    test databases.
+    """
+
+    def __init__(self):
+        self.path = None
+        self.state = {'databases': {}, 'fixtures': {}}
+
+    @property
+    def installed(self):
+        return self.path is not None
+
+    def install(self, path):
+        """Takes over the creation of the test databases."""
+
+        from django.db import connections
+
+        if self.installed:
+            return
+        self.path = path
+        if os.path.exists(path):
+            input = open(path)
+            try:
+                self.state = json.load(input)
+            finally:
+                input.close()
+
+        for alias in connections:
+            self._patch(connections[alias])
+
+        # Flushing the database removes the fixtures.
+        connect_flush_receiver(self._forget_fixtures)
+
+    def _patch(self, connection):
+        creation = connection.creation
+        create, destroy = creation.create_test_db, creation.destroy_test_db
+
+        def create_test_db(*args, **kwargs):
+            return self._create_test_db(connection, create, *args, **kwargs)
+
+        def destroy_test_db(old_database_name, *args, **kwargs):
+            if connection.alias not in self.state['databases']:
+                return destroy(old_database_name, *args, **kwargs)
+            connection.close()
+            connection.settings_dict['NAME'] = old_database_name
+
+        creation.create_test_db = create_test_db
+        creation.destroy_test_db = destroy_test_db
+
+    def _create_test_db(self, connection, create, *args, **kwargs):
+        name = connection.creation._get_test_db_name()
+        kept = {'name': name, 'schema': get_schema_fingerprint()}
+        databases = self.state['databases']
+
+        if name == ':memory:':
+            databases.pop(connection.alias, None)
+            return create(*args, **kwargs)
+
+        if databases.get(connection.alias) == kept and \
+           _database_exists(connection, name):
+            log.info("Reusing the test database %s.", name)
+            connection.close()
+            connection.settings_dict['NAME'] = name
+            if hasattr(connection.features, 'confirm'):
+                connection.features.confirm()
+            return name
+
+        # The kept database is outdated, replace it without asking.
+        if len(args) > 1:
+            args = args[:1] + (True,) + args[2:]
+        else:
+            kwargs['autoclobber'] = True
+        name = create(*args, **kwargs)
+
+        databases[connection.alias] = kept
+        self.state['fixtures'] = {}
+        self.save()
+        return name
+
+    def _forget_fixtures(self, **kwargs):
+        if self.state['fixtures']:
+            self.state['fixtures'] = {}
+            self.save()
+
+    def is_loaded(self, fixtures):
+        """Returns True if `fixtures` were loaded into the kept database and
+        didn't change since.
+        """
+
+        if not self.installed:
+            return False
+        key = '\n'.join(fixtures)
+        fixtures_hash = get_fixtures_hash(fixtures)
+        return fixtures_hash is not None and \
+                self.state['fixtures'].get(key) == fixtures_hash
+
+    def record_fixtures(self, fixtures):
+        """Stores that `fixtures` were loaded into the kept database."""
+
+        if not self.installed:
+            return
+        self.state['fixtures']['\n'.join(fixtures)] = \
+                get_fixtures_hash(fixtures)
+        self.save()
+
+    def save(self):
+        output = open(self.path, 'w')
+        try:
+            json.dump(self.state, output, indent=2, sort_keys=True)
+        finally:
+            output.close()
+
+
+keeper = TestDatabaseKeeper()
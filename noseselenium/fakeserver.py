@@ -0,0 +1,213 @@
+# -*- coding: utf-8 -*-
+"""
+noseselenium.fakeserver
+~~~~~~~~~~~~~~~~~~~~~~~
+
+An in-process stand-in for the Selenium RC server. It speaks the driver
+protocol on ``/selenium-server/driver/`` and answers with canned responses,
+so the client and the plugins can be exercised without a browser::
+
+   server = FakeSeleniumServer(responses={'getTitle': 'Welcome'})
+   server.start()
+   sel = selenium(server.host, server.port, '*fake', 'http://testserver/')
+   sel.start()
+   assert sel.get_title() == 'Welcome'
+   sel.stop()
+   server.stop()
+
+Run ``python -m noseselenium.fakeserver`` to serve on a fixed port.
+
+:copyright: 2010-2011, Pascal Hartig <phartig@weluse.de>
+:license: BSD, see LICENSE for more details.
+"""
+
+import threading
+import time
+import uuid
+
+from SocketServer import ThreadingMixIn
+from BaseHTTPServer import HTTPServer, BaseHTTPRequestHandler
+from urlparse import urlparse, parse_qs
+
+
+DRIVER_PATH = '/selenium-server/driver/'
+
+
+def _escape(value):
+    """Escapes a single value of an array response."""
+
+    return unicode(value).replace('\\', '\\\\').replace(',', '\\,')
+
+
+def format_response(value):
+    """Turns a canned value into a driver response body.
+
+    `None` is a plain ``OK``, booleans become ``true``/``false``, lists and
+    tuples are joined like string arrays and exceptions are reported as
+    errors.
+    """
+
+    if value is None:
+        return u'OK'
+    if isinstance(value, Exception):
+        return u'ERROR: %s' % value
+    if isinstance(value, bool):
+        return u'OK,' + (value and u'true' or u'false')
+    if isinstance(value, (list, tuple)):
+        return u'OK,' + u','.join([_escape(item) for item in value])
+    return u'OK,' + unicode(value)
+
+
+class FakeDriverHandler(BaseHTTPRequestHandler):
+    """Handles driver commands sent via GET or POST."""
+
+    def do_GET(self):
+        url = urlparse(self.path)
+        self.handle_command(url.path, url.query)
+
+    def do_POST(self):
+        length = int(self.headers.getheader('content-length') or 0)
+        self.handle_command(urlparse(self.path).path, self.rfile.read(length))
+
+    def handle_command(self, path, query):
+        if path.rstrip('/') != DRIVER_PATH.rstrip('/'):
+            self.send_error(404)
+            return
+
+        params = parse_qs(query)
+        verb = params.get('cmd', [''])[0].decode('utf-8')
+        args = []
+        while str(len(args) + 1) in params:
+            args.append(params[str(len(args) + 1)][0].decode('utf-8'))
+        session_id = params.get('sessionId', [None])[0]
+
+        body = self.server.respond(verb, args, session_id).encode('utf-8')
+        self.send_response(200)
+        self.send_header('Content-Type', 'text/plain; charset=utf-8')
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        """Keeps the test output clean."""
+
+
+class FakeSeleniumServer(ThreadingMixIn, HTTPServer):
+    """
+    Fake Selenium RC server running in a background thread.
+
+    `responses` maps command names to canned values (see
+    :func:`format_response`) or to callables that receive the argument list
+    and return such a value. Commands without a canned response answer with
+    an empty string for ``get*`` commands, ``false`` for ``is*`` commands and
+    a plain ``OK`` otherwise.
+
+    `latency` delays every response by the given number of seconds. It may
+    also be a callable that receives the command name.
+
+    Every command is recorded in :attr:`commands` as a
+    ``(session_id, verb, args)`` tuple.
+    """
+
+    daemon_threads = True
+    allow_reuse_address = True
+
+    def __init__(self, address='127.0.0.1', port=0, responses=None,
+                 latency=0):
+        HTTPServer.__init__(self, (address, port), FakeDriverHandler)
+        self.responses = dict(responses or {})
+        self.latency = latency
+        self.commands = []
+        self.sessions = set()
+        self._lock = threading.Lock()
+        self._thread = None
+
+    @property
+    def host(self):
+        return self.server_address[0]
+
+    @property
+    def port(self):
+        return self.server_address[1]
+
+    def start(self):
+        """Starts serving in a daemon thread."""
+
+        self._thread = threading.Thread(target=self.serve_forever,
+                                        kwargs={'poll_interval': 0.05})
+        self._thread.setDaemon(True)
+        self._thread.start()
+
+    def stop(self):
+        """Stops serving and closes the socket."""
+
+        if self._thread is not None:
+            self.shutdown()
+            self._thread.join()
+            self._thread = None
+        self.server_close()
+
+    def respond(self, verb, args, session_id):
+        """Builds the response body for a single command."""
+
+        latency = self.latency
+        if callable(latency):
+            latency = latency(verb)
+        if latency:
+            time.sleep(latency)
+
+        with self._lock:
+            self.commands.append((session_id, verb, args))
+
+            if verb == 'getNewBrowserSession':
+                session_id = uuid.uuid4().hex
+                self.sessions.add(session_id)
+                return format_response(session_id)
+
+            if verb == 'shutDownSeleniumServer':
+                threading.Thread(target=self.shutdown).start()
+                return format_response(None)
+
+            if session_id not in self.sessions:
+                return (u"ERROR Server Exception: sessionId %s doesn't "
+                        u"exist; perhaps this session was already stopped?"
+                        % session_id)
+
+            if verb == 'testComplete':
+                self.sessions.discard(session_id)
+                return format_response(None)
+
+        if verb in self.responses:
+            value = self.responses[verb]
+            if callable(value):
+                value = value(args)
+            return format_response(value)
+        if verb.startswith('get'):
+            return format_response(u'')
+        if verb.startswith('is'):
+            return format_response(False)
+        return format_response(None)
+
+
+def main():
+    """Serves until interrupted."""
+
+    from optparse import OptionParser
+
+    parser = OptionParser(usage="%prog [options]")
+    parser.add_option('--address', default='127.0.0.1')
+    parser.add_option('--port', type='int', default=4444)
+    parser.add_option('--latency', type='float', default=0,
+                      help="Seconds to wait before answering a command.")
+    options, args = parser.parse_args()
+
+    server = FakeSeleniumServer(options.address, options.port,
+                                latency=options.latency)
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        server.server_close()
+
+
+if __name__ == '__main__':
+    main()
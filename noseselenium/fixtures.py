@@ -0,0 +1,390 @@
+# -*- coding: utf-8 -*-
+"""
+noseselenium.fixtures
+~~~~~~~~~~~~~~~~~~~~~
+
+Helpers for the fixtures loaded by the selenium fixtures plugin.
+
+:copyright: 2010-2011, Pascal Hartig <phartig@weluse.de>
+:license: BSD, see LICENSE for more details.
+"""
+
+import os
+import bz2
+import cPickle
+import glob
+import gzip
+import hashlib
+import logging
+
+from contextlib import contextmanager
+
+
+log = logging.getLogger('noseselenium')
+
+# SQLite limits the number of parameters of a statement to 999.
+MAX_PARAMETERS = 900
+
+COMPRESSION_FORMATS = {
+    'gz': gzip.GzipFile,
+    'bz2': bz2.BZ2File,
+}
+
+
+def get_fixture_dirs():
+    """Returns the directories ``loaddata`` searches for fixtures."""
+
+    from django.conf import settings
+    from django.db.models import get_apps
+
+    dirs = [os.path.join(os.path.dirname(app.__file__), 'fixtures')
+            for app in get_apps()]
+    return dirs + list(settings.FIXTURE_DIRS) + ['']
+
+
+def find_fixture_files(name):
+    """Returns the files ``loaddata`` would load for the fixture `name`,
+    with or without format extension.
+    """
+
+    if os.path.isabs(name):
+        dirs, name = [os.path.dirname(name)], os.path.basename(name)
+    else:
+        dirs = get_fixture_dirs()
+
+    files = []
+    for directory in dirs:
+        path = os.path.join(directory, name)
+        for match in sorted(glob.glob(path) + glob.glob(path + '.*')):
+            if os.path.isfile(match) and match not in files:
+                files.append(match)
+    return files
+
+
+def get_fixtures_hash(fixtures):
+    """
+    Returns a hash of the names and contents of the files of `fixtures`,
+    or None if a fixture can't be found.
+    """
+
+    digest = hashlib.sha1()
+    for name in fixtures:
+        files = find_fixture_files(name)
+        if not files:
+            return None
+        digest.update(name)
+        for path in files:
+            digest.update(path)
+            input = open(path, 'rb')
+            try:
+                digest.update(input.read())
+            finally:
+                input.close()
+    return digest.hexdigest()
+
+
+def _open_fixture(path):
+    """Returns the serialization format of the fixture file `path` and the
+    opened file, or None if it isn't a fixture.
+    """
+
+    from django.core import serializers
+
+    name, ext = os.path.splitext(path)
+    opener = open
+    if ext[1:] in COMPRESSION_FORMATS:
+        opener = COMPRESSION_FORMATS[ext[1:]]
+        name, ext = os.path.splitext(name)
+    if ext[1:] not in serializers.get_public_serializer_formats():
+        return None
+    return ext[1:], opener(path, 'r')
+
+
+def sort_models(models):
+    """Orders `models` so that models come after the models they refer to
+    with foreign keys, as far as there are no cycles.
+    """
+
+    remaining = list(models)
+    ordered = []
+    while remaining:
+        for model in remaining:
+            dependencies = [field.rel.to for field in model._meta.fields
+                            if field.rel is not None and
+                            field.rel.to is not model]
+            dependencies.extend(model._meta.parents.keys())
+            if not [dependency for dependency in dependencies
+                    if dependency in remaining]:
+                break
+        else:
+            # A cycle, the constraint checks are deferred anyway.
+            model = remaining[0]
+        remaining.remove(model)
+        ordered.append(model)
+    return ordered
+
+
+@contextmanager
+def _constraint_checks_deferred(connection):
+    """Defers the foreign key checks of the current transaction."""
+
+    if hasattr(connection, 'constraint_checks_disabled'):
+        with connection.constraint_checks_disabled():
+            yield
+    elif connection.vendor == 'postgresql':
+        connection.cursor().execute('SET CONSTRAINTS ALL DEFERRED')
+        yield
+    elif connection.vendor == 'mysql':
+        cursor = connection.cursor()
+        cursor.execute('SET foreign_key_checks = 0')
+        try:
+            yield
+        finally:
+            cursor.execute('SET foreign_key_checks = 1')
+    else:
+        yield
+
+
+def _delete_rows(connection, model, column, values):
+    """Deletes the rows of `model` whose `column` is in `values`, without
+    cascading or sending signals.
+    """
+
+    qn = connection.ops.quote_name
+    cursor = connection.cursor()
+    for start in range(0, len(values), MAX_PARAMETERS):
+        batch = values[start:start + MAX_PARAMETERS]
+        cursor.execute('DELETE FROM %s WHERE %s IN (%s)' % (
+            qn(model._meta.db_table), qn(column),
+            ', '.join(['%s'] * len(batch))), batch)
+
+
+def _insert(model, objects, using):
+    manager = model._base_manager.db_manager(using)
+    if hasattr(manager, 'bulk_create') and not model._meta.parents:
+        size = max(MAX_PARAMETERS // len(model._meta.local_fields), 1)
+        for start in range(0, len(objects), size):
+            manager.bulk_create(objects[start:start + size])
+    else:
+        from django.db.models import Model
+        for obj in objects:
+            Model.save_base(obj, using=using, raw=True)
+
+
+def _insert_m2m(connection, model, m2m_data, using):
+    """Replaces the many-to-many relations of the loaded objects."""
+
+    for field_name, relations in m2m_data.items():
+        field = model._meta.get_field(field_name)
+        through = field.rel.through
+        if not through._meta.auto_created:
+            # Rows of explicit intermediate models come with the fixture.
+            continue
+
+        source = through._meta.get_field(field.m2m_field_name())
+        target = through._meta.get_field(field.m2m_reverse_field_name())
+        _delete_rows(connection, through, source.column, relations.keys())
+        _insert(through, [
+            through(**{source.attname: pk, target.attname: target_pk})
+            for pk, target_pks in relations.items()
+            for target_pk in target_pks], using)
+
+
+def deserialize_fixture(name, using):
+    """Returns the objects of the fixture `name` as ``(object, m2m_data)``
+    tuples.
+    """
+
+    from django.core import serializers
+
+    files = [fixture for fixture in map(_open_fixture,
+                                        find_fixture_files(name))
+             if fixture is not None]
+    if not files:
+        log.warning("No fixture named '%s' found.", name)
+
+    objects = []
+    for format, input in files:
+        try:
+            for deserialized in serializers.deserialize(format, input,
+                                                        using=using):
+                objects.append((deserialized.object,
+                                deserialized.m2m_data or {}))
+        finally:
+            input.close()
+    return objects
+
+
+# Compiled fixture paths by fixture, database, cache directory and the
+# stat results of the fixture files.
+_compiled_paths = {}
+
+
+def get_compiled_path(name, using, cache_dir):
+    """Returns the path of the compiled fixture `name`, which changes with
+    the contents of the fixture and the models, or None if the fixture
+    can't be found. The fixture files are only hashed again if their size
+    or modification time changed.
+    """
+
+    from noseselenium.database import get_schema_fingerprint
+
+    stats = []
+    for path in find_fixture_files(name):
+        stat = os.stat(path)
+        stats.append((path, stat.st_mtime, stat.st_size))
+    key = (name, using, cache_dir, tuple(stats))
+    if key in _compiled_paths:
+        return _compiled_paths[key]
+
+    fixture_hash = get_fixtures_hash([name])
+    if fixture_hash is None:
+        return None
+    # Pickled instances of changed models can't be trusted.
+    digest = hashlib.sha1(fixture_hash)
+    digest.update(get_schema_fingerprint())
+    path = _compiled_paths[key] = os.path.join(
+        cache_dir, '%s-%s.pickle' % (using, digest.hexdigest()))
+    return path
+
+
+def compile_fixture(name, using, cache_dir):
+    """
+    Deserializes the fixture `name` and stores the objects pickled in
+    `cache_dir`. Returns the objects like :func:`deserialize_fixture`.
+    """
+
+    objects = deserialize_fixture(name, using)
+    path = get_compiled_path(name, using, cache_dir)
+    if path is None:
+        return objects
+
+    if not os.path.isdir(cache_dir):
+        os.makedirs(cache_dir)
+    # Written under a temporary name, so that parallel runs never read a
+    # partial file.
+    tmp_path = '%s.%d.tmp' % (path, os.getpid())
+    output = open(tmp_path, 'wb')
+    try:
+        cPickle.dump(objects, output, cPickle.HIGHEST_PROTOCOL)
+    finally:
+        output.close()
+    os.rename(tmp_path, path)
+    return objects
+
+
+def read_fixture(name, using, cache_dir=None):
+    """
+    Returns the objects of the fixture `name` like
+    :func:`deserialize_fixture`. If `cache_dir` is given, the compiled
+    fixture is used if it's up to date, otherwise it's compiled.
+    """
+
+    if cache_dir is None:
+        return deserialize_fixture(name, using)
+
+    path = get_compiled_path(name, using, cache_dir)
+    if path is not None and os.path.exists(path):
+        input = open(path, 'rb')
+        try:
+            return cPickle.load(input)
+        finally:
+            input.close()
+    return compile_fixture(name, using, cache_dir)
+
+
+def load_fixtures(fixtures, using=None, cache_dir=None):
+    """
+    A faster replacement for ``loaddata``: the objects of all `fixtures`
+    are grouped by model and inserted model by model, with bulk inserts if
+    supported, in one transaction with deferred constraint checks. Existing
+    rows with the same primary keys are replaced. The sequences are reset
+    once at the end. Unlike ``loaddata``, bulk inserts don't send any
+    signals. Without ``bulk_create``, i.e. before django 1.4, and for models
+    with parents, the objects are saved one by one.
+
+    If `cache_dir` is given, the fixtures are read from their compiled form,
+    see :func:`read_fixture`.
+
+    Returns the number of loaded objects.
+    """
+
+    from django.core.management.color import no_style
+    from django.db import connections, DEFAULT_DB_ALIAS
+    from noseselenium.database import atomic
+
+    using = using or DEFAULT_DB_ALIAS
+    connection = connections[using]
+
+    objects = {}
+    m2m_data = {}
+    count = 0
+    for name in fixtures:
+        for obj, relations in read_fixture(name, using, cache_dir):
+            model = obj.__class__
+            # Later fixtures override objects of earlier ones.
+            key = obj.pk is None and id(obj) or obj.pk
+            objects.setdefault(model, {})[key] = obj
+            for field_name, pks in relations.items():
+                m2m_data.setdefault(model, {}).setdefault(
+                    field_name, {})[obj.pk] = pks
+            count += 1
+
+    if not objects:
+        return 0
+
+    with atomic(using):
+        with _constraint_checks_deferred(connection):
+            models = sort_models(objects.keys())
+            for model in reversed(models):
+                _delete_rows(connection, model, model._meta.pk.column,
+                             [obj.pk for obj in objects[model].values()
+                              if obj.pk is not None])
+            for model in models:
+                _insert(model, objects[model].values(), using)
+                if model in m2m_data:
+                    _insert_m2m(connection, model, m2m_data[model], using)
+
+            cursor = connection.cursor()
+            for sql in connection.ops.sequence_reset_sql(no_style(), models):
+                cursor.execute(sql)
+
+    return count
+
+
+def main():
+    """Compiles the given fixtures for ``SELENIUM_FIXTURES_CACHE_DIR``."""
+
+    from optparse import OptionParser
+
+    parser = OptionParser(usage="%prog [options] FIXTURE [FIXTURE ...]")
+    parser.add_option('--settings',
+                      help="The django settings module, defaults to "
+                           "DJANGO_SETTINGS_MODULE.")
+    parser.add_option('--database', default='default',
+                      help="The database alias to compile for.")
+    parser.add_option('--cache-dir',
+                      help="Defaults to SELENIUM_FIXTURES_CACHE_DIR.")
+    options, fixtures = parser.parse_args()
+    if not fixtures:
+        parser.error("No fixture given.")
+    if options.settings:
+        os.environ['DJANGO_SETTINGS_MODULE'] = options.settings
+
+    from django.conf import settings
+
+    cache_dir = options.cache_dir or \
+            getattr(settings, 'SELENIUM_FIXTURES_CACHE_DIR', None)
+    if not cache_dir:
+        parser.error("No cache directory given.")
+
+    for name in fixtures:
+        objects = compile_fixture(name, options.database, cache_dir)
+        print '%s: %d objects, %s' % (name, len(objects),
+                                      get_compiled_path(name,
+                                                        options.database,
+                                                        cache_dir))
+
+
+if __name__ == '__main__':
+    main()
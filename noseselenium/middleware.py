@@ -0,0 +1,438 @@
+# -*- coding: utf-8 -*-
+"""
+noseselenium.middleware
+~~~~~~~~~~~~~~~~~~~~~~~
+
+WSGI middleware for the live servers.
+
+:copyright: 2010-2011, Pascal Hartig <phartig@weluse.de>
+:license: BSD, see LICENSE for more details.
+"""
+
+import os
+import re
+import zlib
+import logging
+import threading
+
+from timeit import default_timer
+
+
+log = logging.getLogger('noseselenium.liveserver')
+
+_STRING_LITERAL = re.compile(r"'(?:[^']|'')*'")
+_NUMBER_LITERAL = re.compile(r'\b\d+(?:\.\d+)?\b')
+
+
+def normalize_sql(sql):
+    """Replaces literals in `sql`, so that queries only differing in their
+    parameters compare equal.
+    """
+
+    return _NUMBER_LITERAL.sub('?', _STRING_LITERAL.sub('?', sql))
+
+
+class ClosingIterator(object):
+    """
+    Wraps a WSGI response iterable, counts the bytes sent and calls
+    `callback` with that count once the server closes the response.
+    """
+
+    def __init__(self, iterable, callback):
+        self.iterable = iterable
+        self.callback = callback
+        self.size = 0
+
+    def __iter__(self):
+        for chunk in self.iterable:
+            self.size += len(chunk)
+            yield chunk
+
+    def close(self):
+        try:
+            if hasattr(self.iterable, 'close'):
+                self.iterable.close()
+        finally:
+            self.callback(self.size)
+
+
+class RequestLog(object):
+    """
+    Collects the metrics of all requests served by the live server. The
+    live server plugin keeps :attr:`current_test` up to date, so that the
+    requests can be attributed to the test that caused them.
+    """
+
+    def __init__(self, slow_request=None):
+        self.slow_request = slow_request
+        self.current_test = None
+        self.requests = []
+
+    def add(self, request):
+        """Stores the metrics of a single request."""
+
+        request['test'] = self.current_test
+        self.requests.append(request)
+
+        if self.slow_request is not None and \
+           request['latency'] >= self.slow_request:
+            log.warning("Slow request: %s %s took %.3fs with %d queries "
+                        "(%s)", request['method'], request['path'],
+                        request['latency'], request['queries'],
+                        request['test'])
+
+    def _aggregate(self, key):
+        groups = {}
+        for request in self.requests:
+            group = groups.setdefault(request[key], {
+                key: request[key],
+                'count': 0,
+                'latency': 0.0,
+                'max_latency': 0.0,
+                'queries': 0,
+                'query_time': 0.0,
+            })
+            group['count'] += 1
+            group['latency'] += request['latency']
+            group['max_latency'] = max(group['max_latency'],
+                                       request['latency'])
+            group['queries'] += request['queries']
+            group['query_time'] += request['query_time']
+        return groups.values()
+
+    def slowest_endpoints(self, limit=10):
+        """Returns the paths with the highest mean latency."""
+
+        return sorted(self._aggregate('path'), reverse=True,
+                      key=lambda group: group['latency'] / group['count'])[
+                          :limit]
+
+    def slowest_tests(self, limit=10):
+        """Returns the tests that kept the server busy the longest."""
+
+        return sorted(self._aggregate('test'), reverse=True,
+                      key=lambda group: group['latency'])[:limit]
+
+    def repeated_queries(self, threshold=5, limit=10):
+        """Returns the requests that ran the same statement at least
+        `threshold` times, a typical sign of N+1 queries.
+        """
+
+        offenders = {}
+        for request in self.requests:
+            sql, count = request['repeated_query']
+            if count < threshold:
+                continue
+            key = (request['path'], sql)
+            if offenders.get(key, (0,))[0] < count:
+                offenders[key] = (count, request['test'])
+
+        return sorted([(count, path, sql, test)
+                       for (path, sql), (count, test) in offenders.items()],
+                      reverse=True)[:limit]
+
+    def write_report(self, stream, limit=10, threshold=5):
+        """Writes the slowest endpoints and tests and the N+1 offenders."""
+
+        stream.writeln('Live server: %d requests' % len(self.requests))
+
+        stream.writeln('Slowest endpoints (mean, max, requests, queries):')
+        for group in self.slowest_endpoints(limit):
+            stream.writeln('  %8.3fs %8.3fs %6d %8d  %s' % (
+                group['latency'] / group['count'], group['max_latency'],
+                group['count'], group['queries'], group['path']))
+
+        stream.writeln('Busiest tests (server time, requests, queries):')
+        for group in self.slowest_tests(limit):
+            stream.writeln('  %8.3fs %6d %8d  %s' % (
+                group['latency'], group['count'], group['queries'],
+                group['test']))
+
+        offenders = self.repeated_queries(threshold, limit)
+        if offenders:
+            stream.writeln('Repeated queries (possible N+1):')
+            for count, path, sql, test in offenders:
+                stream.writeln('  %6dx %s (%s)' % (count, path, test))
+                stream.writeln('          %s' % sql)
+
+
+class RequestMetricsMiddleware(object):
+    """
+    Records path, status, latency, response size and the SQL queries of
+    every request to a :class:`RequestLog`.
+    """
+
+    def __init__(self, application, request_log):
+        self.application = application
+        self.request_log = request_log
+
+    def __call__(self, environ, start_response):
+        from django.db import connections
+
+        # The connections are thread local, so this only affects the
+        # thread serving the request. The queries are reset by django
+        # when the request starts.
+        for alias in connections:
+            connections[alias].use_debug_cursor = True
+
+        status = []
+
+        def _start_response(status_line, headers, *args):
+            status[:] = [status_line]
+            return start_response(status_line, headers, *args)
+
+        start = default_timer()
+        response = self.application(environ, _start_response)
+
+        queries = []
+        for alias in connections:
+            queries.extend(connections[alias].queries)
+
+        def finish(size):
+            self.request_log.add({
+                'method': environ.get('REQUEST_METHOD'),
+                'path': environ.get('PATH_INFO'),
+                'status': status and int(status[0].split(' ', 1)[0]) or None,
+                'latency': default_timer() - start,
+                'size': size,
+                'queries': len(queries),
+                'query_time': sum([float(query['time'])
+                                   for query in queries]),
+                'repeated_query': self._most_repeated(queries),
+            })
+
+        return ClosingIterator(response, finish)
+
+    def _most_repeated(self, queries):
+        """Returns the most often repeated statement and its count."""
+
+        counts = {}
+        for query in queries:
+            sql = normalize_sql(query['sql'])
+            counts[sql] = counts.get(sql, 0) + 1
+
+        if not counts:
+            return (None, 0)
+        return max([(count, sql) for sql, count in counts.items()])[::-1]
+
+
+class ProfilerMiddleware(object):
+    """
+    Runs every request through one of the profilers in
+    :mod:`noseselenium.profiling`.
+    """
+
+    def __init__(self, application, profiler):
+        self.application = application
+        self.profiler = profiler
+
+    def __call__(self, environ, start_response):
+        return self.profiler.profile(self.application, environ,
+                                     start_response)
+
+
+class SharedConnectionMiddleware(object):
+    """
+    Lets the threads serving requests use the database connections of the
+    test thread. In-memory SQLite databases only exist within their
+    connection, so this is the only way to share them. The connections
+    aren't safe to be used concurrently, so the requests are served one at a
+    time.
+    """
+
+    def __init__(self, application, connections):
+        self.application = application
+        # The database wrappers of the test thread by alias.
+        self.connections = connections
+        # The DB-API connections, as the wrappers of django < 1.4 are
+        # thread local.
+        self.raw_connections = dict([
+            (alias, wrapper.connection)
+            for alias, wrapper in connections.items()])
+        self.lock = threading.Lock()
+
+    def __call__(self, environ, start_response):
+        from django.db import connections
+
+        self.lock.acquire()
+        try:
+            for alias, wrapper in self.connections.items():
+                if hasattr(connections, '__setitem__'):
+                    # The connection handler is thread local since django
+                    # 1.4.
+                    wrapper.allow_thread_sharing = True
+                    connections[alias] = wrapper
+                else:
+                    wrapper.connection = self.raw_connections[alias]
+            response = self.application(environ, start_response)
+        except Exception:
+            self.lock.release()
+            raise
+
+        return ClosingIterator(response, lambda size: self.lock.release())
+
+
+# Content types worth compressing, besides text/*.
+COMPRESSIBLE_TYPES = ('application/javascript', 'application/x-javascript',
+                      'application/json', 'application/xml',
+                      'application/xhtml+xml', 'image/svg+xml')
+
+# Preferred encoding first.
+ENCODINGS = ('gzip', 'deflate')
+
+
+def get_accepted_encoding(header):
+    """Returns the preferred encoding of :data:`ENCODINGS` the
+    ``Accept-Encoding`` header `header` accepts, or None.
+    """
+
+    accepted = {}
+    for coding in (header or '').split(','):
+        name, sep, params = coding.strip().partition(';')
+        quality = 1.0
+        for param in params.split(';'):
+            key, sep, value = param.strip().partition('=')
+            if key == 'q':
+                try:
+                    quality = float(value)
+                except ValueError:
+                    quality = 0.0
+        accepted[name.strip().lower()] = quality
+
+    for encoding in ENCODINGS:
+        if accepted.get(encoding, accepted.get('*', 0.0)) > 0:
+            return encoding
+    return None
+
+
+def compress(data, encoding, level=6):
+    """Compresses `data` with the content coding `encoding`."""
+
+    if encoding == 'gzip':
+        # Adding 16 to the window bits selects the gzip container.
+        compressor = zlib.compressobj(level, zlib.DEFLATED,
+                                      16 + zlib.MAX_WBITS)
+    else:
+        compressor = zlib.compressobj(level)
+    return compressor.compress(data) + compressor.flush()
+
+
+class CompressionCache(object):
+    """
+    The compressed bodies of static files by file path and encoding. An
+    entry is only used while the modification time of the file is unchanged.
+    """
+
+    def __init__(self):
+        self.entries = {}
+        self.hits = 0
+        self.misses = 0
+        self.lock = threading.Lock()
+
+    def get(self, path, encoding, mtime):
+        with self.lock:
+            entry = self.entries.get((path, encoding))
+            if entry is not None and entry[0] == mtime:
+                self.hits += 1
+                return entry[1]
+            self.misses += 1
+            return None
+
+    def set(self, path, encoding, mtime, body):
+        with self.lock:
+            self.entries[(path, encoding)] = (mtime, body)
+
+
+class CompressionMiddleware(object):
+    """
+    Compresses successful textual responses with gzip or deflate, whichever
+    the browser accepts. The response is buffered, so that the
+    ``Content-Length`` can be set. Bodies smaller than `min_size` bytes are
+    sent as they are.
+
+    Static files are compressed once and then served from `cache`.
+    `find_file` returns the file served for a request path, or None if the
+    path isn't a static file.
+    """
+
+    def __init__(self, application, level=6, min_size=200, cache=None,
+                 find_file=None):
+        self.application = application
+        self.level = level
+        self.min_size = min_size
+        self.cache = cache
+        self.find_file = find_file
+
+    def __call__(self, environ, start_response):
+        encoding = get_accepted_encoding(environ.get('HTTP_ACCEPT_ENCODING'))
+        if encoding is None:
+            return self.application(environ, start_response)
+
+        response = []
+        body = []
+
+        def _start_response(status, headers, exc_info=None):
+            if exc_info is not None and response:
+                raise exc_info[0], exc_info[1], exc_info[2]
+            response[:] = [status, headers, exc_info]
+            return body.append
+
+        result = self.application(environ, _start_response)
+        try:
+            for chunk in result:
+                body.append(chunk)
+        finally:
+            if hasattr(result, 'close'):
+                result.close()
+
+        status, headers, exc_info = response
+        body = ''.join(body)
+        if not self._should_compress(status, headers, body):
+            start_response(status, headers, exc_info)
+            return [body]
+
+        body = self._compress(environ.get('PATH_INFO'), encoding, body)
+        headers = [(name, value) for name, value in headers
+                   if name.lower() != 'content-length']
+        headers.extend([('Content-Encoding', encoding),
+                        ('Content-Length', str(len(body)))])
+        vary = [value for name, value in headers if name.lower() == 'vary']
+        if not vary:
+            headers.append(('Vary', 'Accept-Encoding'))
+        elif 'accept-encoding' not in vary[0].lower():
+            headers = [(name, value) for name, value in headers
+                       if name.lower() != 'vary']
+            headers.append(('Vary', '%s, Accept-Encoding' % vary[0]))
+        start_response(status, headers, exc_info)
+        return [body]
+
+    def _should_compress(self, status, headers, body):
+        if not status.startswith('200') or len(body) < self.min_size:
+            return False
+
+        content_type = ''
+        for name, value in headers:
+            name = name.lower()
+            if name == 'content-encoding':
+                return False
+            elif name == 'content-type':
+                content_type = value.split(';', 1)[0].strip().lower()
+        return content_type.startswith('text/') or \
+                content_type in COMPRESSIBLE_TYPES
+
+    def _compress(self, path, encoding, body):
+        filename = None
+        if self.cache is not None and self.find_file is not None:
+            filename = self.find_file(path)
+        if filename is None:
+            return compress(body, encoding, self.level)
+
+        try:
+            mtime = os.stat(filename).st_mtime
+        except OSError:
+            return compress(body, encoding, self.level)
+        compressed = self.cache.get(filename, encoding, mtime)
+        if compressed is None:
+            compressed = compress(body, encoding, self.level)
+            self.cache.set(filename, encoding, mtime, compressed)
+        return compressed
@@ -0,0 +1,120 @@
+# -*- coding: utf-8 -*-
+"""
+noseselenium.nodes
+~~~~~~~~~~~~~~~~~~
+
+Scheduling of browser sessions across several Selenium RC servers.
+
+:copyright: 2010-2011, Pascal Hartig <phartig@weluse.de>
+:license: BSD, see LICENSE for more details.
+"""
+
+import time
+import socket
+import logging
+import threading
+
+
+log = logging.getLogger('noseselenium')
+
+
+class NoNodeAvailable(socket.error):
+    """Raised if all nodes are out of rotation. Derives from socket.error,
+    so it's treated like a single unavailable Selenium server.
+    """
+
+
+class Node(object):
+    """A Selenium RC server that can run `capacity` sessions at once."""
+
+    def __init__(self, host, port=4444, capacity=1):
+        self.host = host
+        self.port = int(port)
+        self.capacity = int(capacity)
+        self.sessions = 0
+        # Moving average of the latency observed on this node.
+        self.latency = None
+        # Time until which the node is out of rotation.
+        self.dead_until = None
+
+    @classmethod
+    def parse(cls, value):
+        """Creates a node from ``'host:port'``, a ``(host, port[,
+        capacity])`` tuple or a dict with the same keys.
+        """
+
+        if isinstance(value, dict):
+            return cls(**value)
+        if isinstance(value, basestring):
+            host, sep, port = value.rpartition(':')
+            if not sep:
+                return cls(value)
+            return cls(host, port)
+        return cls(*value)
+
+    @property
+    def load(self):
+        return float(self.sessions) / max(self.capacity, 1)
+
+    def is_alive(self, now):
+        return self.dead_until is None or self.dead_until <= now
+
+    def __repr__(self):
+        return '<Node %s:%d (%d/%d)>' % (self.host, self.port, self.sessions,
+                                         self.capacity)
+
+
+class NodePool(object):
+    """
+    Assigns sessions to the least loaded node that is alive, preferring
+    nodes with a lower latency on ties. Nodes that refuse connections are
+    taken out of rotation for `retry_after` seconds.
+    """
+
+    def __init__(self, nodes, retry_after=60, smoothing=0.2):
+        self.nodes = [isinstance(node, Node) and node or Node.parse(node)
+                      for node in nodes]
+        self.retry_after = retry_after
+        self.smoothing = smoothing
+        self._lock = threading.Lock()
+
+    def acquire(self):
+        """Reserves a session on the best node and returns the node."""
+
+        now = time.time()
+        with self._lock:
+            alive = [node for node in self.nodes if node.is_alive(now)]
+            if not alive:
+                raise NoNodeAvailable("No Selenium node available.")
+
+            free = [node for node in alive if node.sessions < node.capacity]
+            if not free:
+                log.warning("All Selenium nodes are at capacity.")
+                free = alive
+
+            node = min(free, key=lambda node: (node.load, node.latency or 0))
+            node.sessions += 1
+            return node
+
+    def release(self, node):
+        """Frees a session reserved by :meth:`acquire`."""
+
+        with self._lock:
+            node.sessions = max(node.sessions - 1, 0)
+
+    def mark_dead(self, node):
+        """Takes `node` out of rotation."""
+
+        log.warning("Selenium node %s:%d is not available, retrying in %d "
+                    "seconds.", node.host, node.port, self.retry_after)
+        with self._lock:
+            node.dead_until = time.time() + self.retry_after
+
+    def record_latency(self, node, seconds):
+        """Adds an observed latency to the moving average of `node`."""
+
+        with self._lock:
+            if node.latency is None:
+                node.latency = seconds
+            else:
+                node.latency += self.smoothing * (seconds - node.latency)
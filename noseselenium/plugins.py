@@ -12,16 +12,35 @@ _django-sane-testing: http://github.com/Almad/django-sane-testing/
 :license: BSD, see LICENSE for more details.
 """
 
+import os
 import socket
 import nose
 import time
 import threading
 import django
+import logging
 
 from nose.plugins import Plugin
 from nose.plugins.skip import SkipTest
-from noseselenium.thirdparty.selenium import selenium
+from nose.suite import ContextSuite
+from inspect import isclass
+from noseselenium.client import SeleniumClient, BrowserMatrix
+from noseselenium.server import SeleniumServer
+from noseselenium.nodes import NodePool
+from noseselenium.database import get_clone_name, clone_test_db, \
+        drop_test_db, keeper, connect_flush_receiver, set_autocommit
+from noseselenium.timing import timer, load_durations
+from noseselenium.trace import CommandTrace
+from noseselenium.fixtures import load_fixtures
+from noseselenium.data import registry as data_registry
+from noseselenium.middleware import RequestLog, RequestMetricsMiddleware, \
+        ProfilerMiddleware, SharedConnectionMiddleware, \
+        CompressionMiddleware, CompressionCache
+from noseselenium.profiling import PROFILERS
+from noseselenium.asyncserver import AsyncWSGIServer
+import unittest
 from unittest import TestCase
+from multiprocessing.util import Finalize
 # Liveserver imports
 from SocketServer import ThreadingMixIn
 from BaseHTTPServer import HTTPServer
@@ -31,11 +50,23 @@ from django.core.servers.basehttp import WSGIRequestHandler, \
 from django.db.backends.creation import TEST_DATABASE_PREFIX
 
 
+log = logging.getLogger('noseselenium')
+
+# How long a browser session is kept: for a single test, for the tests of a
+# class or for the whole run.
+SESSION_SCOPES = ('test', 'class', 'run')
+
+# Values selenium starts sessions with, restored if a class changed them.
+SESSION_DEFAULTS = {'speed': 0, 'timeout': 30000}
+
+
 def _get_test_db_name(connection):
     """Tries to build the test database name like django does."""
 
     if connection.settings_dict['TEST_NAME']:
         return connection.settings_dict['TEST_NAME']
+    elif connection.vendor == 'sqlite':
+        return ':memory:'
     else:
         old_name = connection.settings_dict['NAME']
         if old_name.startswith(TEST_DATABASE_PREFIX):
@@ -45,15 +76,37 @@ def _get_test_db_name(connection):
                     old_name
 
 
-def _set_autocommit(connection):
-        """Make sure a connection is in autocommit mode."""
-        if hasattr(connection.connection, "autocommit"):
-            if callable(connection.connection.autocommit):
-                connection.connection.autocommit(True)
-            else:
-                connection.connection.autocommit = True
-        elif hasattr(connection.connection, "set_isolation_level"):
-            connection.connection.set_isolation_level(0)
+# Maps the database aliases to the names of the test databases and of their
+# clones used by this process.
+_test_db_clones = {}
+
+
+def _is_in_memory(connection):
+    """Returns True for in-memory SQLite databases."""
+
+    return connection.vendor == 'sqlite' and \
+            connection.settings_dict['NAME'] == ':memory:'
+
+
+def _share_in_memory_db(connection):
+    """
+    Moves an in-memory database to a connection that may be used by other
+    threads. SQLite connections are bound to the thread that opened them
+    unless `check_same_thread` is disabled when opening them.
+    """
+
+    options = connection.settings_dict['OPTIONS']
+    if options.get('check_same_thread', True) is False:
+        return
+
+    options['check_same_thread'] = False
+    old_connection, connection.connection = connection.connection, None
+    # Opens a new connection with the options.
+    connection.cursor()
+    if old_connection is not None:
+        connection.connection.executescript(
+            '\n'.join(old_connection.iterdump()))
+        old_connection.close()
 
 
 def _setup_test_db():
@@ -63,10 +116,18 @@ def _setup_test_db():
 
     for alias in connections:
         connection = connections[alias]
-        connection.close()
+        if alias in _test_db_clones:
+            test_db_name = _test_db_clones[alias][1]
+        else:
+            test_db_name = _get_test_db_name(connection)
 
-        test_db_name = _get_test_db_name(connection)
-        connection.settings_dict['NAME'] = test_db_name
+        # Closing the connection would lose an in-memory database.
+        if not _is_in_memory(connection):
+            connection.close()
+            connection.settings_dict['NAME'] = test_db_name
+        if _is_in_memory(connection):
+            _share_in_memory_db(connection)
+            continue
 
         # SUPPORTS_TRANSACTIONS is not needed in newer versions of djangoo
         if not hasattr(connection.features, 'supports_transactions'):
@@ -75,7 +136,63 @@ def _setup_test_db():
 
         # Trigger side effects.
         connection.cursor()
-        _set_autocommit(connection)
+        set_autocommit(connection)
+
+
+def _clone_test_dbs(suffix):
+    """Clones the test databases and points the connections to the
+    clones. The clones are removed at the end of the run or when the
+    process exits.
+    """
+
+    from django.db import connections
+
+    if not _test_db_clones:
+        # Workers of the multiprocess plugin exit without running atexit
+        # handlers, but they run the multiprocessing finalizers.
+        Finalize(None, _drop_test_db_clones, exitpriority=0)
+
+    for alias in connections:
+        connection = connections[alias]
+        source = _get_test_db_name(connection)
+        if source == ':memory:':
+            # Every process has its own in-memory database anyway.
+            continue
+
+        connection.close()
+        target = get_clone_name(connection, source, suffix)
+        clone_test_db(connection, source, target)
+        _test_db_clones[alias] = (source, target)
+        connection.settings_dict['NAME'] = target
+
+
+def _drop_test_db_clones():
+    """Removes the clones created by :func:`_clone_test_dbs` and points
+    the connections back to the test databases, so that django destroys
+    those instead of the clones.
+    """
+
+    from django.db import connections
+
+    while _test_db_clones:
+        alias, (source, name) = _test_db_clones.popitem()
+        connection = connections[alias]
+        try:
+            drop_test_db(connection, name)
+        except Exception:
+            log.warning("Failed to remove the test database %s", name,
+                        exc_info=True)
+        connection.settings_dict['NAME'] = source
+
+
+def _keep_test_db():
+    """Keeps the test databases across runs if enabled."""
+
+    from django.conf import settings
+
+    if getattr(settings, 'LIVE_SERVER_KEEP_TEST_DB', False):
+        keeper.install(getattr(settings, 'LIVE_SERVER_KEEP_TEST_DB_STATE',
+                               '.noseselenium-testdb.json'))
 
 
 def _patch_static_handler(handler):
@@ -83,12 +200,63 @@ def _patch_static_handler(handler):
     """
 
     if django.VERSION[:2] < (1, 3):
-        return
+        return handler
 
     from django.contrib.staticfiles.handlers import StaticFilesHandler
     return StaticFilesHandler(handler)
 
 
+def _get_handler(serve_static=True):
+    """Builds the django WSGI handler for the live servers."""
+
+    handler = AdminMediaHandler(WSGIHandler())
+    if serve_static:
+        handler = _patch_static_handler(handler)
+    return handler
+
+
+class StaticFileFinder(object):
+    """
+    Resolves request paths to the files the static handlers of
+    :func:`_get_handler` serve for them, so that they can be cached by
+    file.
+    """
+
+    def __init__(self, serve_static=True):
+        self.handlers = [AdminMediaHandler(None)]
+        if serve_static and django.VERSION[:2] >= (1, 3):
+            from django.contrib.staticfiles.handlers import \
+                    StaticFilesHandler
+            self.handlers.insert(0, StaticFilesHandler(None))
+
+    def __call__(self, path):
+        """Returns the file served for `path` or None."""
+
+        for handler in self.handlers:
+            if not handler._should_handle(path):
+                continue
+            try:
+                filename = self._find(handler, path)
+            except ValueError:
+                # Outside of the static directories.
+                return None
+            if filename and os.path.isfile(filename):
+                return filename
+            return None
+        return None
+
+    def _find(self, handler, path):
+        if isinstance(handler, AdminMediaHandler):
+            return handler.file_path(path)
+
+        import posixpath
+        import urllib
+        from django.contrib.staticfiles import finders
+
+        return finders.find(posixpath.normpath(
+            urllib.unquote(handler.file_path(path))).lstrip('/'))
+
+
 def get_test_case_class(nose_test):
     """
     Extracts the class from the nose tests that depends on whether it's a
@@ -100,40 +268,269 @@ def get_test_case_class(nose_test):
         return nose_test.test.__class__
 
 
-class SeleniumPlugin(Plugin):
+def _get_test_instance(nose_test):
+    """
+    Returns the test case instance of a nose test or None for function test
+    cases.
+    """
+    if isinstance(nose_test.test, nose.case.MethodTestCase):
+        return nose_test.test.test.im_self
+    elif isinstance(nose_test.test, TestCase):
+        return nose_test.test.run.im_self
+    return None
+
+
+def _get_required_data(nose_test, test_case):
+    """Returns the names of the data the test requires with
+    :func:`~noseselenium.cases.requires_data`.
+    """
+
+    names = tuple(getattr(test_case, "required_data", ()))
+    if isinstance(nose_test.test, nose.case.MethodTestCase):
+        method = nose_test.test.method
+    elif isinstance(nose_test.test, TestCase):
+        method = getattr(nose_test.test, nose_test.test._testMethodName,
+                         None)
+    else:
+        return names
+    return names + tuple(getattr(method, "required_data", ()))
+
+
+class TestMetadata(object):
+    """
+    Everything the plugins need to know about a single test: its class, its
+    instance and the class attributes that configure the plugins. The
+    attributes are looked up once per class.
+    """
+
+    _class_flags = {}
+    _class_options = {}
+
+    def __init__(self, nose_test):
+        self.test_case = get_test_case_class(nose_test)
+        self.instance = _get_test_instance(nose_test)
+        self.selenium_test, self.start_live_server, self.selenium_fixtures = \
+                self._get_class_flags(self.test_case)
+        self.required_data = _get_required_data(nose_test, self.test_case)
+
+    @property
+    def options(self):
+        """The selenium options of the class, see :meth:`_get_class_options`.
+        """
+
+        return self._get_class_options(self.test_case)
+
+    @classmethod
+    def _get_class_flags(cls, test_case):
+        try:
+            return cls._class_flags[test_case]
+        except KeyError:
+            flags = cls._class_flags[test_case] = (
+                bool(getattr(test_case, "selenium_test", False)),
+                bool(getattr(test_case, "start_live_server", False)),
+                tuple(getattr(test_case, "selenium_fixtures", [])),
+            )
+            return flags
+
+    @classmethod
+    def _get_class_options(cls, test_case):
+        """
+        Returns the options of the session and the fixtures of the tests of
+        `test_case`: its `selenium_*` attributes, falling back to the
+        settings.
+        """
+
+        try:
+            return cls._class_options[test_case]
+        except KeyError:
+            pass
+
+        from django.conf import settings
+
+        def option(attribute, default):
+            value = getattr(test_case, attribute, None)
+            if value is None:
+                return default
+            return value
+
+        browsers = option("selenium_browser_command", None)
+        if browsers is None:
+            browsers = getattr(settings, "SELENIUM_BROWSER_COMMANDS", None) \
+                    or getattr(settings, "SELENIUM_BROWSER_COMMAND", "*chrome")
+        if not isinstance(browsers, basestring):
+            browsers = tuple(browsers)
+
+        reuse = getattr(settings, "SELENIUM_REUSE_SESSIONS", False)
+        options = cls._class_options[test_case] = {
+            'browsers': browsers,
+            'url_root': option("selenium_url_root", getattr(
+                settings, "SELENIUM_URL_ROOT", "http://127.0.0.1:8000/")),
+            'session_scope': option("selenium_session_scope",
+                                    reuse and 'run' or 'test'),
+            'fixtures_scope': option("selenium_fixtures_scope", getattr(
+                settings, "SELENIUM_FIXTURES_SCOPE", "test")),
+            'speed': option("selenium_speed",
+                            getattr(settings, "SELENIUM_SPEED", None)),
+            'timeout': option("selenium_timeout",
+                              getattr(settings, "SELENIUM_TIMEOUT", None)),
+        }
+        if options['session_scope'] not in SESSION_SCOPES:
+            raise ValueError("Invalid selenium session scope of %s: %r"
+                             % (test_case.__name__,
+                                options['session_scope']))
+        return options
+
+
+def get_test_metadata(nose_test):
+    """Returns the :class:`TestMetadata` of a nose test, computing it on
+    first access.
+    """
+
+    try:
+        return nose_test._noseselenium_metadata
+    except AttributeError:
+        metadata = nose_test._noseselenium_metadata = TestMetadata(nose_test)
+        return metadata
+
+
+class MetadataPlugin(Plugin):
+    """Base class of the plugins sharing the :class:`TestMetadata`."""
+
+    def prepareTestCase(self, test):
+        """Computes the metadata before any plugin hook needs it."""
+
+        get_test_metadata(test)
+
+
+def _get_trace_path(test):
+    """Returns the file to record the commands of `test` to, if enabled."""
+
+    from django.conf import settings
+
+    trace_dir = getattr(settings, "SELENIUM_TRACE_DIR", None)
+    if not trace_dir:
+        return None
+
+    if not os.path.isdir(trace_dir):
+        os.makedirs(trace_dir)
+    return os.path.join(trace_dir, '%s.trace' % test.id())
+
+
+class SeleniumPlugin(MetadataPlugin):
     """
     Adds a selenium attribute to the nose test case and reads the parameters
     from the django config.
     Only works with class based tests, so far.
+
+    If `SELENIUM_REUSE_SESSIONS` is enabled, the browser session is reset
+    and kept for the following tests instead of being stopped after each
+    test. A kept session is recycled once it exceeds the limits configured by
+    `SELENIUM_SESSION_MAX_COMMANDS`, `SELENIUM_SESSION_MAX_AGE` or
+    `SELENIUM_SESSION_MAX_DRIFT`.
+
+    If `SELENIUM_SERVER_JAR` is set, the plugin starts the Selenium server
+    for the run unless one is already running.
+
+    If `SELENIUM_NODES` lists several Selenium servers, each session is
+    started on the least loaded one that is alive, see
+    :class:`~noseselenium.nodes.NodePool`.
+
+    Test classes can override the browser, the URL root, the session scope,
+    the speed and the timeout, see
+    :class:`~noseselenium.cases.SeleniumTestCaseMixin`. A kept session is
+    only reused by tests with the same browser and URL root.
     """
 
     activation_parameter = "--with-selenium"
     name = "selenium"
     score = 80
 
+    def __init__(self):
+        MetadataPlugin.__init__(self)
+        # The session injected into the running test.
+        self.current_session = None
+        # A session kept for the next test.
+        self.idle_session = None
+        # The browsers and URL root of the kept session, and the class it's
+        # kept for if its scope is the class.
+        self.idle_key = None
+        self.idle_owner = None
+        # The Selenium server started by the plugin.
+        self.server = None
+        # Schedules the sessions if several servers are configured.
+        self.node_pool = None
+
+    def begin(self):
+        """Sets up the configured nodes and starts the Selenium server if
+        configured.
+        """
+
+        from django.conf import settings
+
+        nodes = getattr(settings, "SELENIUM_NODES", None)
+        if nodes:
+            self.node_pool = NodePool(
+                nodes, retry_after=getattr(settings, "SELENIUM_NODE_RETRY",
+                                           60))
+
+        jar = getattr(settings, "SELENIUM_SERVER_JAR", None)
+        if not jar:
+            return
+
+        server = SeleniumServer(
+            jar,
+            host=getattr(settings, "SELENIUM_HOST", "localhost"),
+            port=int(getattr(settings, "SELENIUM_PORT", 4444)),
+            args=getattr(settings, "SELENIUM_SERVER_ARGS", ()),
+            log_file=getattr(settings, "SELENIUM_SERVER_LOG", None))
+
+        if server.is_ready():
+            log.info("Using the Selenium server running on %s:%d.",
+                     server.host, server.port)
+            return
+
+        server.start(timeout=getattr(settings,
+                                     "SELENIUM_SERVER_STARTUP_TIMEOUT", 60))
+        self.server = server
+
     def startTest(self, test):
         """
         When preparing the test, inject a selenium instance.
         """
 
-        test_case = get_test_case_class(test)
-        if getattr(test_case, "selenium_test", False):
+        if get_test_metadata(test).selenium_test:
             self._inject_selenium(test)
 
     def stopTest(self, test):
         """
-        Destroys the selenium connection.
+        Destroys the selenium connection or keeps it for the next test.
         """
 
-        test_case = get_test_case_class(test)
-        if getattr(test_case, 'selenium_started', False):
-            if isinstance(test.test, nose.case.MethodTestCase):
-                self = test.test.test.im_self
-            elif isinstance(test.test, TestCase):
-                self = test.test.run.im_self
+        sel = self.current_session
+        if sel is None:
+            return
+
+        self.current_session = None
+        del get_test_metadata(test).instance.selenium
 
-            self.selenium.stop()
-            del self.selenium
+        if sel.trace is not None:
+            sel.trace.save(_get_trace_path(test))
+            sel.trace = None
+
+        with timer.phase(test, 'session_stop'):
+            self._release_session(sel, get_test_metadata(test))
+
+    def finalize(self, result):
+        """Stops the kept session and the Selenium server."""
+
+        try:
+            if self.idle_session is not None:
+                self.idle_session.stop()
+                self.idle_session = None
+        finally:
+            if self.server is not None:
+                self.server.stop()
+                self.server = None
 
     def _inject_selenium(self, test):
         """
@@ -141,60 +538,239 @@ class SeleniumPlugin(Plugin):
         """
         from django.conf import settings
 
-        test_case = get_test_case_class(test)
-        test_case.selenium_plugin_started = True
+        metadata = get_test_metadata(test)
+        metadata.test_case.selenium_plugin_started = True
 
-        # Provide some reasonable default values
-        sel = selenium(
-            getattr(settings, "SELENIUM_HOST", "localhost"),
-            int(getattr(settings, "SELENIUM_PORT", 4444)),
-            getattr(settings, "SELENIUM_BROWSER_COMMAND", "*chrome"),
-            getattr(settings, "SELENIUM_URL_ROOT", "http://127.0.0.1:8000/"))
+        # Only works on method test cases, because we obviously need
+        # self.
+        if metadata.instance is None:
+            raise SkipTest("Test skipped because it's not a method.")
 
         try:
-            sel.start()
+            with timer.phase(test, 'session_start'):
+                sel = self._acquire_session(metadata)
         except socket.error:
             if getattr(settings, "FORCE_SELENIUM_TESTS", False):
                 raise
             else:
                 raise SkipTest("Selenium server not available.")
+
+        if _get_trace_path(test):
+            sel.trace = CommandTrace(sel.browserStartCommand, sel.browserURL)
+
+        metadata.test_case.selenium_started = True
+        self.current_session = sel
+        metadata.instance.selenium = sel
+
+    def _acquire_session(self, metadata):
+        """Returns the kept session if it's healthy and suits the test or
+        starts a new one.
+        """
+
+        options = metadata.options
+        key = (options['browsers'], options['url_root'])
+
+        sel, self.idle_session = self.idle_session, None
+        if sel is not None:
+            reason = self._check_session(sel)
+            if reason is None and key != self.idle_key:
+                reason = "different browser or URL root"
+            if reason is None and self.idle_owner not in (
+                    None, metadata.test_case):
+                reason = "kept for %s" % self.idle_owner.__name__
+            if reason is None:
+                self._apply_options(sel, options)
+                return sel
+            log.info("Recycling selenium session %s: %s", sel.sessionId,
+                     reason)
+            try:
+                sel.stop()
+            except Exception:
+                log.warning("Failed to stop selenium session %s",
+                            sel.sessionId, exc_info=True)
+
+        sel = self._create_session(options)
+        sel.start()
+        sel.applied_options = {}
+        self._apply_options(sel, options)
+        return sel
+
+    def _apply_options(self, sel, options):
+        """Sets the speed and the timeout of the test's class, restoring the
+        defaults if a previous class changed them.
+        """
+
+        for name, setter in (('speed', sel.set_speed),
+                             ('timeout', sel.set_timeout)):
+            value = options[name]
+            if value is None:
+                if name not in sel.applied_options:
+                    continue
+                value = SESSION_DEFAULTS[name]
+            if sel.applied_options.get(name) != value:
+                setter(value)
+                sel.applied_options[name] = value
+
+    def _release_session(self, sel, metadata):
+        """Stops the session of a finished test or resets and keeps it."""
+
+        from django.conf import settings
+
+        options = metadata.options
+        if options['session_scope'] == 'test':
+            sel.stop()
+            return
+
+        try:
+            sel.reset(getattr(settings, "SELENIUM_RESET_URL", "about:blank"))
+        except Exception:
+            log.warning("Failed to reset selenium session %s, stopping it",
+                        sel.sessionId, exc_info=True)
+            try:
+                sel.stop()
+            except Exception:
+                pass
         else:
-            test_case.selenium_started = True
-            # Only works on method test cases, because we obviously need
-            # self.
-            if isinstance(test.test, nose.case.MethodTestCase):
-                test.test.test.im_self.selenium = sel
-            elif isinstance(test.test, TestCase):
-                test.test.run.im_self.selenium = sel
-            else:
-                raise SkipTest("Test skipped because it's not a method.")
+            self.idle_session = sel
+            self.idle_key = (options['browsers'], options['url_root'])
+            self.idle_owner = None
+            if options['session_scope'] == 'class':
+                self.idle_owner = metadata.test_case
+
+    def _check_session(self, sel):
+        """Returns why `sel` has to be recycled or None."""
+
+        from django.conf import settings
+
+        return sel.stats.check(
+            max_commands=getattr(settings, "SELENIUM_SESSION_MAX_COMMANDS",
+                                 None),
+            max_age=getattr(settings, "SELENIUM_SESSION_MAX_AGE", None),
+            max_drift=getattr(settings, "SELENIUM_SESSION_MAX_DRIFT", None))
+
+    def _create_session(self, options):
+        """Creates a client for the browser and URL root of `options`,
+        driving several browsers at once if a list of browsers is given.
+        """
+
+        from django.conf import settings
+
+        browsers = options['browsers']
+        if isinstance(browsers, basestring):
+            return self._create_client(browsers, options['url_root'])
+
+        return BrowserMatrix(
+            [self._create_client(browser, options['url_root'])
+             for browser in browsers],
+            compare_results=getattr(settings, "SELENIUM_MATRIX_COMPARE",
+                                    True))
+
+    def _create_client(self, browser, url_root):
+        """Creates a client for a single browser."""
+
+        from django.conf import settings
+
+        # Provide some reasonable default values
+        return SeleniumClient(
+            getattr(settings, "SELENIUM_HOST", "localhost"),
+            int(getattr(settings, "SELENIUM_PORT", 4444)),
+            browser,
+            url_root,
+            cache_locators=getattr(settings, "SELENIUM_CACHE_LOCATORS",
+                                   False),
+            cache_getters=getattr(settings, "SELENIUM_CACHE_GETTERS", False),
+            node_pool=self.node_pool)
 
 
-class SeleniumFixturesPlugin(Plugin):
+class SeleniumFixturesPlugin(MetadataPlugin):
     """
     Loads fixtures defined in the attribute `selenium_fixtures`. It does,
     however, not take care of removing them after the test or even the whole
     test case is run.
     Django fixtures are usually run in transactions so a test server accessing
     the test database won't be able access the data.
+
+    If `SELENIUM_FIXTURES_SCOPE` or the `selenium_fixtures_scope` of the
+    test class is ``'group'``, the fixtures are only loaded if they differ
+    from the ones of the previous test or the database was flushed since,
+    so that consecutive tests with the same fixtures share the data.
+
+    If the test database is kept across runs, fixtures that were loaded
+    into it in a previous run and didn't change since aren't loaded again
+    for their first test.
+
+    With `SELENIUM_FIXTURES_LOADER` set to ``'bulk'``, the fixtures are
+    loaded by :func:`~noseselenium.fixtures.load_fixtures` instead of
+    ``loaddata``.
+    If `SELENIUM_FIXTURES_CACHE_DIR` is set as well, the deserialized
+    fixtures are kept there and reused while the files don't change.
+
+    The data builders of `selenium_data` a test requires are run after the
+    fixtures are loaded, unless they already ran since the database was last
+    flushed, see :mod:`noseselenium.data`.
     """
 
     activation_parameter = "--with-selenium-fixtures"
     name = "selenium-fixtures"
     score = 80
 
+    def __init__(self):
+        MetadataPlugin.__init__(self)
+        # The fixtures of the previous test.
+        self.loaded_fixtures = None
+        # All fixtures used during the run.
+        self.used_fixtures = set()
+
+    def begin(self):
+        _keep_test_db()
+        data_registry.connect()
+
+        # Flushing the database, e.g. by a TransactionTestCase, removes the
+        # fixtures of the group.
+        connect_flush_receiver(self._forget_loaded_fixtures)
+
+    def _forget_loaded_fixtures(self, **kwargs):
+        self.loaded_fixtures = None
+
     def startTest(self, test):
         """
         When preparing the database, check for the `selenium_fixtures`
-        attribute and load those.
+        attribute and load those, then build the required data.
         """
 
-        from django.test.testcases import call_command
+        metadata = get_test_metadata(test)
+        fixtures = metadata.selenium_fixtures
+        scope = metadata.options['fixtures_scope']
 
-        test_case = get_test_case_class(test)
-        fixtures = getattr(test_case, "selenium_fixtures", [])
+        if fixtures and not (scope == 'group' and
+                             fixtures == self.loaded_fixtures):
+            first_use = fixtures not in self.used_fixtures
+            self.used_fixtures.add(fixtures)
+
+            if not (first_use and keeper.is_loaded(fixtures)):
+                with timer.phase(test, 'fixtures'):
+                    self._load(fixtures)
+                if first_use:
+                    keeper.record_fixtures(fixtures)
+        self.loaded_fixtures = fixtures
+
+        if metadata.required_data and metadata.instance is not None:
+            with timer.phase(test, 'fixtures'):
+                metadata.instance.selenium_objects = data_registry.build(
+                    getattr(metadata.test_case, "selenium_data", {}),
+                    metadata.required_data)
+
+    def _load(self, fixtures):
+        """Loads and commits `fixtures` with the configured loader."""
+
+        from django.conf import settings
+        from django.test.testcases import call_command
 
-        if fixtures:
+        if getattr(settings, "SELENIUM_FIXTURES_LOADER", "loaddata") == \
+           "bulk":
+            load_fixtures(fixtures, cache_dir=getattr(
+                settings, "SELENIUM_FIXTURES_CACHE_DIR", None))
+        else:
             call_command('loaddata', *fixtures, **{
                 'verbosity': 1,
                 # Necessary to let the test server access them.
@@ -202,6 +778,279 @@ class SeleniumFixturesPlugin(Plugin):
             })
 
 
+def _get_tests(suite):
+    """Returns the tests of `suite` as a list. Collected suites may be
+    generators, so the list is stored as the tests of the suite.
+    """
+
+    tests = list(suite._tests)
+    suite._tests = tests
+    return tests
+
+
+def _is_group(test):
+    """Returns True if `test` is a suite of modules, packages or other
+    suites rather than the suite of a test class.
+    """
+
+    return isinstance(test, unittest.TestSuite) and not (
+        isinstance(test, ContextSuite) and isclass(test.context))
+
+
+def get_order_key(test):
+    """
+    Returns the key :class:`SeleniumOrderingPlugin` sorts a test or suite
+    by: whether it needs the live server, whether it needs a browser and its
+    fixtures. Suites are sorted by their first test.
+    """
+
+    if _is_group(test):
+        for child in _get_tests(test):
+            return get_order_key(child)
+        return (False, False, ())
+    elif isinstance(test, ContextSuite):
+        test_case = test.context
+    else:
+        test_case = get_test_case_class(test)
+
+    selenium_test, start_live_server, selenium_fixtures = \
+            TestMetadata._get_class_flags(test_case)
+    return (start_live_server, selenium_test, selenium_fixtures)
+
+
+def _sort_suite(suite):
+    """
+    Sorts the tests of `suite` by :func:`get_order_key`. Classes of modules
+    and packages without fixtures are moved up into the enclosing suite, so
+    that they can be sorted across modules. Tests of a single class keep
+    their order.
+    """
+
+    tests = []
+    for test in _get_tests(suite):
+        if _is_group(test):
+            _sort_suite(test)
+            if not isinstance(test, ContextSuite) or \
+               test.context is None or \
+               not test.implementsAnyFixture(test.context, None):
+                tests.extend(_get_tests(test))
+                continue
+        tests.append(test)
+
+    tests.sort(key=get_order_key)
+    suite._tests = tests
+
+
+class SeleniumOrderingPlugin(Plugin):
+    """
+    Reorders the collected tests, so that tests needing the live server, a
+    browser or the same fixtures run next to each other. Combined with
+    session reuse and the ``'group'`` fixture scope, every expensive setup
+    is only done once per group.
+
+    Modules and packages with setup or teardown functions are kept
+    together, only their contents are sorted.
+    """
+
+    activation_parameter = "--with-selenium-ordering"
+    name = "selenium-ordering"
+
+    def prepareTest(self, test):
+        """Sorts the suite in place."""
+
+        if isinstance(test, unittest.TestSuite):
+            _sort_suite(test)
+
+
+class SeleniumTimingPlugin(Plugin):
+    """
+    Reports the time each test spent starting the live server, setting up
+    the test database, loading fixtures, starting and stopping the selenium
+    session and running the test itself.
+    """
+
+    activation_parameter = "--with-selenium-timing"
+    name = "selenium-timing"
+    # Wraps the test run, so the other plugins have to prepare it first.
+    score = 1
+
+    def configure(self, options, conf):
+        Plugin.configure(self, options, conf)
+        if self.enabled:
+            timer.enabled = True
+
+    def prepareTestCase(self, test):
+        """Measures the complete run of the test."""
+
+        def run(result):
+            start = time.time()
+            try:
+                test.test(result)
+            finally:
+                timer.record_total(test, time.time() - start)
+
+        return run
+
+    def report(self, stream):
+        """
+        Prints the phases of the slowest tests and writes all of them to
+        `SELENIUM_TIMING_XML` if set. The duration of every test is saved to
+        `SELENIUM_DURATIONS_FILE` if set.
+        """
+
+        from django.conf import settings
+
+        timer.write_report(stream, getattr(settings,
+                                           "SELENIUM_TIMING_REPORT_LIMIT",
+                                           20))
+
+        path = getattr(settings, "SELENIUM_TIMING_XML", None)
+        if path:
+            output = open(path, 'w')
+            try:
+                timer.write_xml(output)
+            finally:
+                output.close()
+
+        path = getattr(settings, "SELENIUM_DURATIONS_FILE", None)
+        if path:
+            timer.save_durations(path)
+
+
+def _get_units(suite):
+    """Returns the test classes and the tests outside of classes in
+    `suite`.
+    """
+
+    units = []
+    for test in _get_tests(suite):
+        if _is_group(test):
+            units.extend(_get_units(test))
+        else:
+            units.append(test)
+    return units
+
+
+def _get_unit_ids(unit):
+    if isinstance(unit, unittest.TestSuite):
+        ids = []
+        for test in _get_tests(unit):
+            ids.extend(_get_unit_ids(test))
+        return ids
+    return [unit.id()]
+
+
+def _keep_units(suite, keep):
+    """Removes all test classes and tests not in `keep` from `suite`."""
+
+    tests = []
+    for test in _get_tests(suite):
+        if _is_group(test):
+            _keep_units(test, keep)
+            tests.append(test)
+        elif id(test) in keep:
+            tests.append(test)
+    suite._tests = tests
+
+
+def assign_shards(units, count):
+    """
+    Distributes `units` across `count` shards by longest processing time
+    first: the longest unit is assigned to the shard with the least work
+    until all units are assigned. `units` are ``(duration, unit)`` tuples,
+    units with an unknown duration of `None` are weighted with the mean
+    duration of the others. Returns a list of unit lists, one per shard.
+    """
+
+    known = [duration for duration, unit in units if duration is not None]
+    default = known and sum(known) / len(known) or 1.0
+
+    shards = [[] for index in range(count)]
+    loads = [0.0] * count
+    weighted = [(duration is None and default or duration, index, unit)
+                for index, (duration, unit) in enumerate(units)]
+    # Ties are broken by the collection order, so that every shard computes
+    # the same assignment.
+    weighted.sort(key=lambda item: (-item[0], item[1]))
+    for duration, index, unit in weighted:
+        shard = loads.index(min(loads))
+        shards[shard].append(unit)
+        loads[shard] += duration
+    return shards
+
+
+def _get_worker_id(conf):
+    """Identifies the process among the ones running in parallel: the
+    shard index if sharding is enabled, the process id for workers of the
+    multiprocess plugin and unsharded runs.
+    """
+
+    shard = getattr(conf.options, 'selenium_shard', None)
+    if shard and not conf.worker:
+        return 'shard%s' % shard.split('/')[0]
+    return str(os.getpid())
+
+
+class SeleniumShardPlugin(Plugin):
+    """
+    Runs one of several shards of the collected tests, e.g. on one of
+    several CI workers. Test classes are assigned to the shards by their
+    duration in `SELENIUM_DURATIONS_FILE`, so that the shards take about the
+    same time.
+
+    The durations are recorded by :class:`SeleniumTimingPlugin`, which
+    doesn't see the tests run by workers of the multiprocess plugin. Classes
+    are weighted equally if no durations were recorded.
+    """
+
+    activation_parameter = "--selenium-shard"
+    name = "selenium-shard"
+
+    def options(self, parser, env):
+        parser.add_option(
+            "--selenium-shard", action="store", dest="selenium_shard",
+            default=env.get("NOSE_SELENIUM_SHARD"), metavar="INDEX/COUNT",
+            help="Only run the INDEX-th of COUNT shards of the tests, "
+                 "starting at 1. [NOSE_SELENIUM_SHARD]")
+
+    def configure(self, options, conf):
+        self.conf = conf
+        self.enabled = bool(options.selenium_shard)
+        if not self.enabled:
+            return
+
+        try:
+            index, count = [int(value) for value
+                            in options.selenium_shard.split('/')]
+        except ValueError:
+            raise ValueError("Invalid --selenium-shard %r, expected "
+                             "INDEX/COUNT." % options.selenium_shard)
+        if not 1 <= index <= count:
+            raise ValueError("Invalid --selenium-shard %r, INDEX must be "
+                             "between 1 and COUNT." % options.selenium_shard)
+        self.index, self.count = index, count
+
+    def prepareTest(self, test):
+        """Removes the tests of the other shards from the suite."""
+
+        from django.conf import settings
+
+        if not isinstance(test, unittest.TestSuite):
+            return
+
+        path = getattr(settings, "SELENIUM_DURATIONS_FILE", None)
+        durations = path and load_durations(path) or {}
+
+        units = []
+        for unit in _get_units(test):
+            known = [durations[test_id] for test_id in _get_unit_ids(unit)
+                     if test_id in durations]
+            units.append((known and sum(known) or None, unit))
+
+        shard = assign_shards(units, self.count)[self.index - 1]
+        _keep_units(test, set([id(unit) for unit in shard]))
+
+
 class StoppableWSGIServer(ThreadingMixIn, HTTPServer):
     """WSGIServer with short timeout, so that server thread can stop this
     server.
@@ -253,15 +1102,35 @@ class StoppableWSGIServer(ThreadingMixIn, HTTPServer):
         self.application = application
 
 
-class AbstractLiveServerPlugin(Plugin):
-    """Base class for live servers."""
+class AbstractLiveServerPlugin(MetadataPlugin):
+    """Base class for live servers. The server keeps running across
+    consecutive tests that need it.
+
+    If `LIVE_SERVER_CLONE_TEST_DB` is enabled, the test database serves as
+    template: `LIVE_SERVER_TEMPLATE_FIXTURES` are loaded into it once, and
+    every process running tests works on its own clone of it.
+
+    If `LIVE_SERVER_KEEP_TEST_DB` is enabled, the test database is kept
+    after the run and reused by the next one unless the models or
+    migrations changed.
+
+    In-memory SQLite test databases are shared with the threads serving the
+    requests, which are then served one at a time.
+
+    If `LIVE_SERVER_GZIP` is enabled, the responses are compressed, see
+    :class:`~noseselenium.middleware.CompressionMiddleware`.
+    """
 
     score = 70
 
     def __init__(self):
-        Plugin.__init__(self)
+        MetadataPlugin.__init__(self)
         self.server_started = False
         self.server_thread = None
+        self.request_log = None
+        self.profiler = None
+        # Compressed static files, kept across server restarts.
+        self.compression_cache = CompressionCache()
 
     def start_server(self):
         raise NotImplementedError()
@@ -269,50 +1138,155 @@ class AbstractLiveServerPlugin(Plugin):
     def stop_server(self):
         raise NotImplementedError()
 
+    def begin(self):
+        """Keeps the test database, prepares the template and clones the
+        test database if enabled.
+        """
+
+        from django.conf import settings
+        from django.db import connections
+        from django.test.testcases import call_command
+
+        _keep_test_db()
+
+        if not getattr(settings, 'LIVE_SERVER_CLONE_TEST_DB', False):
+            return
+
+        # Workers of the multiprocess plugin use the template prepared by
+        # the main process, which doesn't run any tests itself.
+        if not self.conf.worker:
+            fixtures = getattr(settings, 'LIVE_SERVER_TEMPLATE_FIXTURES', ())
+            if fixtures:
+                _setup_test_db()
+                call_command('loaddata', *fixtures, **{
+                    'verbosity': 0,
+                    'commit': True
+                })
+            for alias in connections:
+                connections[alias].close()
+
+            if getattr(self.conf.options, 'multiprocess_workers', 0):
+                return
+
+        _clone_test_dbs(_get_worker_id(self.conf))
+
+    def get_application(self, serve_static=True):
+        """Builds the WSGI application to serve, including the middleware
+        enabled in the settings.
+        """
+
+        from django.conf import settings
+
+        application = _get_handler(serve_static)
+
+        if getattr(settings, 'LIVE_SERVER_GZIP', False):
+            application = CompressionMiddleware(
+                application,
+                level=getattr(settings, 'LIVE_SERVER_GZIP_LEVEL', 6),
+                min_size=getattr(settings, 'LIVE_SERVER_GZIP_MIN_SIZE', 200),
+                cache=self.compression_cache,
+                find_file=StaticFileFinder(serve_static))
+
+        profiler = getattr(settings, 'LIVE_SERVER_PROFILER', None)
+        if profiler:
+            if self.profiler is None:
+                self.profiler = PROFILERS[profiler](
+                    getattr(settings, 'LIVE_SERVER_PROFILE_DIR',
+                            'liveserver-profiles'),
+                    group_by=getattr(settings, 'LIVE_SERVER_PROFILE_BY',
+                                     'test'))
+            application = ProfilerMiddleware(application, self.profiler)
+
+        if getattr(settings, 'LIVE_SERVER_METRICS', False):
+            if self.request_log is None:
+                self.request_log = RequestLog(
+                    slow_request=getattr(settings,
+                                         'LIVE_SERVER_SLOW_REQUEST', None))
+            application = RequestMetricsMiddleware(application,
+                                                   self.request_log)
+
+        from django.db import connections
+        shared = dict([(alias, connections[alias]) for alias in connections
+                       if _is_in_memory(connections[alias])])
+        if shared:
+            application = SharedConnectionMiddleware(application, shared)
+
+        return application
+
     def startTest(self, test):
-        """Starts the live server."""
+        """Starts the live server if the test needs it and it isn't running
+        yet, or stops it if the test doesn't need it.
+        """
 
         from django.conf import settings
 
-        test_case = get_test_case_class(test)
+        metadata = get_test_metadata(test)
+
+        if self.server_started and not metadata.start_live_server:
+            with timer.phase(test, 'live_server_stop'):
+                self.stop_server()
+            self.server_started = False
 
-        if not self.server_started and \
-           getattr(test_case, "start_live_server", False):
+        if not self.server_started and metadata.start_live_server:
 
-            _setup_test_db()
+            with timer.phase(test, 'setup_test_db'):
+                _setup_test_db()
 
             # Raises an exception if not.
             settings.TEST_MODE = True
 
-            self.start_server(
-                address=getattr(settings, 'LIVE_SERVER_ADDRESS',
-                                '0.0.0.0'),
-                port=getattr(settings, 'LIVE_SERVER_PORT',
-                             8080),
-                serve_static=getattr(settings, 'LIVE_SERVER_STATIC', True)
-            )
+            with timer.phase(test, 'live_server_start'):
+                self.start_server(
+                    address=getattr(settings, 'LIVE_SERVER_ADDRESS',
+                                    '0.0.0.0'),
+                    port=getattr(settings, 'LIVE_SERVER_PORT',
+                                 8080),
+                    serve_static=getattr(settings, 'LIVE_SERVER_STATIC',
+                                         True)
+                )
 
             self.server_started = True
-            setattr(test_case, 'http_plugin_started', True)
+            setattr(metadata.test_case, 'http_plugin_started', True)
 
-    def stopTest(self, test):
-        """Stops the live server if necessary."""
+        if self.request_log is not None:
+            self.request_log.current_test = test.id()
+        if self.profiler is not None:
+            self.profiler.current_test = test.id()
 
-        test_case = get_test_case_class(test)
-        if self.server_started and \
-           getattr(test_case, 'http_plugin_started', False):
+    def report(self, stream):
+        """Prints the request metrics if enabled."""
 
-            self.stop_server()
-            self.server_started = False
+        from django.conf import settings
+
+        if self.request_log is not None:
+            self.request_log.write_report(
+                stream,
+                threshold=getattr(settings, 'LIVE_SERVER_REPEATED_QUERIES',
+                                  5))
+
+    def finalize(self, result):
+        """Stops the live server, writes the profiles if enabled and
+        removes the clones of the test database.
+        """
+
+        try:
+            if self.server_started:
+                self.stop_server()
+                self.server_started = False
+        finally:
+            if self.profiler is not None:
+                self.profiler.stop()
+            _drop_test_db_clones()
 
 
 class TestServerThread(threading.Thread):
     """Thread for running a http server while tests are running."""
 
-    def __init__(self, address, port, serve_static=True):
+    def __init__(self, address, port, serve_static=True, application=None):
         self.address = address
         self.port = port
         self.serve_static = serve_static
+        self.application = application
         self._stopevent = threading.Event()
         self.started = threading.Event()
         self.error = None
@@ -321,9 +1295,9 @@ class TestServerThread(threading.Thread):
     def run(self):
         """Sets up test server and loops over handling http requests."""
         try:
-            handler = AdminMediaHandler(WSGIHandler())
-            if self.serve_static:
-                handler = _patch_static_handler(handler)
+            handler = self.application
+            if handler is None:
+                handler = _get_handler(self.serve_static)
 
             server_address = (self.address, self.port)
             httpd = StoppableWSGIServer(server_address, WSGIRequestHandler)
@@ -357,7 +1331,9 @@ class DjangoLiveServerPlugin(AbstractLiveServerPlugin):
     activation_parameter = '--with-djangoliveserver'
 
     def start_server(self, address='0.0.0.0', port=8000, serve_static=True):
-        self.server_thread = TestServerThread(address, port, serve_static)
+        self.server_thread = TestServerThread(
+            address, port, serve_static,
+            application=self.get_application(serve_static))
         self.server_thread.start()
         self.server_thread.started.wait()
         if self.server_thread.error:
@@ -380,9 +1356,7 @@ class CherryPyLiveServerPlugin(AbstractLiveServerPlugin):
         from cherrypy.wsgiserver import CherryPyWSGIServer
         from threading import Thread
 
-        _application = AdminMediaHandler(WSGIHandler())
-        if serve_static:
-            _application = _patch_static_handler(_application)
+        _application = self.get_application(serve_static)
 
         def application(environ, start_response):
             environ['PATH_INFO'] = environ['SCRIPT_NAME'] + \
@@ -400,3 +1374,37 @@ class CherryPyLiveServerPlugin(AbstractLiveServerPlugin):
 
     def stop_server(self):
         self.httpd.stop()
+
+
+class AsyncLiveServerPlugin(AbstractLiveServerPlugin):
+    """
+    Live server on an event loop, see
+    :class:`~noseselenium.asyncserver.AsyncWSGIServer`. Keeps connections
+    alive and only uses `LIVE_SERVER_THREADS` threads to run django,
+    however many browsers are connected.
+
+    Static files are streamed by the event loop, bypassing the middleware,
+    unless `LIVE_SERVER_GZIP` is enabled, which compresses and caches them.
+    """
+
+    name = 'asyncliveserver'
+    activation_parameter = '--with-asyncliveserver'
+
+    def start_server(self, address='0.0.0.0', port=8000, serve_static=True):
+        from django.conf import settings
+
+        find_file = None
+        if not getattr(settings, 'LIVE_SERVER_GZIP', False):
+            find_file = StaticFileFinder(serve_static)
+
+        try:
+            self.httpd = AsyncWSGIServer(
+                (address, port), self.get_application(serve_static),
+                threads=getattr(settings, 'LIVE_SERVER_THREADS', 10),
+                find_file=find_file)
+        except socket.error as e:
+            raise WSGIServerException(e)
+        self.httpd.start()
+
+    def stop_server(self):
+        self.httpd.stop()
@@ -0,0 +1,177 @@
+# -*- coding: utf-8 -*-
+"""
+noseselenium.profiling
+~~~~~~~~~~~~~~~~~~~~~~
+
+Profilers for the requests served by the live server. Profiles are
+grouped by test or by URL pattern and written to a directory at the end of
+the run.
+
+:copyright: 2010-2011, Pascal Hartig <phartig@weluse.de>
+:license: BSD, see LICENSE for more details.
+"""
+
+import os
+import re
+import sys
+import time
+import pstats
+import cProfile
+import threading
+
+
+def _safe_filename(name):
+    return re.sub(r'[^\w.-]+', '_', name).strip('_') or 'unknown'
+
+
+class BaseProfiler(object):
+    """
+    Common base of the profilers. :attr:`current_test` is kept up to date by
+    the live server plugin.
+    """
+
+    extension = None
+
+    def __init__(self, directory, group_by='test'):
+        self.directory = directory
+        self.group_by = group_by
+        self.current_test = None
+        self._lock = threading.Lock()
+
+    def group(self, environ):
+        """Returns the name of the profile a request belongs to."""
+
+        if self.group_by != 'url':
+            return self.current_test or 'unknown'
+
+        from django.core.urlresolvers import resolve, Resolver404
+
+        try:
+            func = resolve(environ.get('PATH_INFO', '/'))[0]
+        except Resolver404:
+            return 'unresolved'
+        return '%s.%s' % (func.__module__,
+                          getattr(func, '__name__', func.__class__.__name__))
+
+    def profile(self, application, environ, start_response):
+        """Calls the application while profiling it."""
+
+        raise NotImplementedError()
+
+    def stop(self):
+        """Stops profiling and writes the results."""
+
+        if not os.path.isdir(self.directory):
+            os.makedirs(self.directory)
+        with self._lock:
+            for group in self.groups():
+                self.dump(group, os.path.join(self.directory, '%s.%s' % (
+                    _safe_filename(group), self.extension)))
+
+    def groups(self):
+        raise NotImplementedError()
+
+    def dump(self, group, path):
+        raise NotImplementedError()
+
+
+class CProfileProfiler(BaseProfiler):
+    """Profiles each request with cProfile and writes pstats files."""
+
+    extension = 'pstats'
+
+    def __init__(self, directory, group_by='test'):
+        BaseProfiler.__init__(self, directory, group_by)
+        self.stats = {}
+
+    def profile(self, application, environ, start_response):
+        group = self.group(environ)
+        profile = cProfile.Profile()
+        try:
+            return profile.runcall(application, environ, start_response)
+        finally:
+            with self._lock:
+                if group in self.stats:
+                    self.stats[group].add(profile)
+                else:
+                    self.stats[group] = pstats.Stats(profile)
+
+    def groups(self):
+        return self.stats.keys()
+
+    def dump(self, group, path):
+        self.stats[group].dump_stats(path)
+
+
+class SamplingProfiler(BaseProfiler):
+    """
+    Samples the stacks of the threads serving requests in fixed intervals and
+    writes them in the collapsed format understood by flame graph tools.
+    The overhead doesn't depend on the number of function calls, so this is
+    better suited for long running requests than :class:`CProfileProfiler`.
+    """
+
+    extension = 'collapsed'
+
+    def __init__(self, directory, group_by='test', interval=0.005):
+        BaseProfiler.__init__(self, directory, group_by)
+        self.interval = interval
+        self.samples = {}
+        # Maps the ids of threads currently serving a request to the group
+        # of that request.
+        self._active = {}
+        self._stopevent = threading.Event()
+        self._thread = threading.Thread(target=self._sample)
+        self._thread.setDaemon(True)
+        self._thread.start()
+
+    def profile(self, application, environ, start_response):
+        ident = threading.currentThread().ident
+        self._active[ident] = self.group(environ)
+        try:
+            return application(environ, start_response)
+        finally:
+            del self._active[ident]
+
+    def _sample(self):
+        while not self._stopevent.isSet():
+            frames = sys._current_frames()
+            with self._lock:
+                for ident, group in self._active.items():
+                    if ident in frames:
+                        stack = self._collapse(frames[ident])
+                        counts = self.samples.setdefault(group, {})
+                        counts[stack] = counts.get(stack, 0) + 1
+            time.sleep(self.interval)
+
+    def _collapse(self, frame):
+        stack = []
+        while frame is not None:
+            code = frame.f_code
+            stack.append('%s (%s:%d)' % (code.co_name,
+                                         os.path.basename(code.co_filename),
+                                         code.co_firstlineno))
+            frame = frame.f_back
+        return ';'.join(reversed(stack))
+
+    def stop(self):
+        self._stopevent.set()
+        self._thread.join()
+        BaseProfiler.stop(self)
+
+    def groups(self):
+        return self.samples.keys()
+
+    def dump(self, group, path):
+        output = open(path, 'w')
+        try:
+            for stack, count in sorted(self.samples[group].items()):
+                output.write('%s %d\n' % (stack, count))
+        finally:
+            output.close()
+
+
+PROFILERS = {
+    'cprofile': CProfileProfiler,
+    'sampling': SamplingProfiler,
+}
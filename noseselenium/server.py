@@ -0,0 +1,100 @@
+# -*- coding: utf-8 -*-
+"""
+noseselenium.server
+~~~~~~~~~~~~~~~~~~~
+
+Management of a local Selenium RC server process.
+
+:copyright: 2010-2011, Pascal Hartig <phartig@weluse.de>
+:license: BSD, see LICENSE for more details.
+"""
+
+import os
+import time
+import socket
+import httplib
+import logging
+import subprocess
+
+from noseselenium.thirdparty.selenium import selenium
+
+
+log = logging.getLogger('noseselenium')
+
+
+class SeleniumServerError(Exception):
+    """Raised if the Selenium server can't be started."""
+
+
+class SeleniumServer(object):
+    """
+    A Selenium RC server started from its jar file. The server is ready once
+    its driver URL answers HTTP requests.
+    """
+
+    def __init__(self, jar, host='localhost', port=4444, args=(),
+                 java='java', log_file=None):
+        self.jar = jar
+        self.host = host
+        self.port = port
+        self.args = list(args)
+        self.java = java
+        self.log_file = log_file
+        self.process = None
+
+    def is_ready(self):
+        """Returns True if a server answers on the configured port."""
+
+        conn = httplib.HTTPConnection(self.host, self.port, timeout=1)
+        try:
+            conn.request('GET', '/selenium-server/driver/?cmd=getLogMessages')
+            conn.getresponse().read()
+        except (socket.error, httplib.HTTPException):
+            return False
+        finally:
+            conn.close()
+        return True
+
+    def start(self, timeout=60):
+        """Launches the server and waits until it's ready."""
+
+        output = open(self.log_file or os.devnull, 'a')
+        try:
+            self.process = subprocess.Popen(
+                [self.java, '-jar', self.jar, '-port', str(self.port)] +
+                self.args, stdout=output, stderr=subprocess.STDOUT)
+        finally:
+            output.close()
+
+        deadline = time.time() + timeout
+        while not self.is_ready():
+            if self.process.poll() is not None:
+                raise SeleniumServerError(
+                    "Selenium server exited with code %d."
+                    % self.process.returncode)
+            if time.time() > deadline:
+                self.stop()
+                raise SeleniumServerError(
+                    "Selenium server not ready after %d seconds." % timeout)
+            time.sleep(.25)
+
+    def stop(self, timeout=10):
+        """Asks the server to shut down and kills it if it doesn't."""
+
+        if self.process is None:
+            return
+
+        try:
+            selenium(self.host, self.port, None, None).do_command(
+                "shutDownSeleniumServer", [])
+        except Exception:
+            pass
+
+        deadline = time.time() + timeout
+        while self.process.poll() is None and time.time() < deadline:
+            time.sleep(.1)
+        if self.process.poll() is None:
+            log.warning("Selenium server didn't shut down, terminating it.")
+            self.process.terminate()
+            self.process.wait()
+        self.process = None
@@ -0,0 +1,168 @@
+# -*- coding: utf-8 -*-
+"""
+noseselenium.timing
+~~~~~~~~~~~~~~~~~~~
+
+Collects the time every selenium test spends in the expensive phases of
+the plugins.
+
+:copyright: 2010-2011, Pascal Hartig <phartig@weluse.de>
+:license: BSD, see LICENSE for more details.
+"""
+
+import os
+import json
+
+from contextlib import contextmanager
+from timeit import default_timer
+from xml.sax.saxutils import quoteattr
+
+
+# All phases in the order they happen during a test. `test` is whatever is
+# left of the test run after subtracting the other phases.
+PHASES = ('live_server_start', 'setup_test_db', 'fixtures', 'session_start',
+          'test', 'session_stop', 'live_server_stop')
+
+
+def load_durations(path):
+    """Returns the durations saved by :meth:`PhaseTimer.save_durations`, an
+    empty dict if `path` doesn't exist.
+    """
+
+    if not os.path.exists(path):
+        return {}
+    input = open(path)
+    try:
+        return json.load(input)
+    finally:
+        input.close()
+
+
+class PhaseTimer(object):
+    """
+    Shared registry the plugins report their phase durations to. Nothing is
+    recorded unless :attr:`enabled` is set.
+    """
+
+    def __init__(self):
+        self.enabled = False
+        self.timings = {}
+        # Test ids in the order they were first seen.
+        self.tests = []
+
+    def record(self, test, phase, seconds):
+        """Adds `seconds` to the `phase` of `test`."""
+
+        if not self.enabled:
+            return
+
+        test_id = test.id()
+        if test_id not in self.timings:
+            self.timings[test_id] = {}
+            self.tests.append(test_id)
+        phases = self.timings[test_id]
+        phases[phase] = phases.get(phase, 0.0) + seconds
+
+    @contextmanager
+    def phase(self, test, phase):
+        """Records the time spent in the `with` block as `phase`."""
+
+        start = default_timer()
+        try:
+            yield
+        finally:
+            self.record(test, phase, default_timer() - start)
+
+    def record_total(self, test, seconds):
+        """Attributes the part of `seconds` not covered by any other phase
+        to the test itself.
+        """
+
+        if not self.enabled:
+            return
+
+        phases = self.timings.get(test.id(), {})
+        self.record(test, 'test',
+                    max(0.0, seconds - sum(phases.values())))
+
+    def totals(self):
+        """Returns the summed up duration per phase."""
+
+        totals = dict.fromkeys(PHASES, 0.0)
+        for phases in self.timings.values():
+            for phase, seconds in phases.items():
+                totals[phase] += seconds
+        return totals
+
+    def durations(self):
+        """Returns the total duration of every test by test id."""
+
+        return dict([(test_id, sum(phases.values()))
+                     for test_id, phases in self.timings.items()])
+
+    def save_durations(self, path):
+        """Merges the durations of this run into the ones saved at `path`,
+        so that tests that didn't run keep their last duration.
+        """
+
+        durations = load_durations(path)
+        durations.update(self.durations())
+        output = open(path, 'w')
+        try:
+            json.dump(durations, output, indent=0, sort_keys=True)
+        finally:
+            output.close()
+
+    def write_report(self, stream, limit=None):
+        """Writes a table of the phases of the slowest tests."""
+
+        tests = sorted(self.tests, reverse=True,
+                       key=lambda test_id: sum(self.timings[test_id].values()))
+        if limit is not None:
+            tests = tests[:limit]
+
+        header = ''.join(['%18s' % phase for phase in PHASES])
+        stream.writeln('Selenium timing (seconds)')
+        stream.writeln('%s  %s' % (header, 'test id'))
+        for test_id in tests:
+            stream.writeln('%s  %s' % (
+                self._format_row(self.timings[test_id]), test_id))
+        stream.writeln('%s  %s' % (self._format_row(self.totals()), 'total'))
+
+    def _format_row(self, phases):
+        return ''.join(['%18.3f' % phases.get(phase, 0.0)
+                        for phase in PHASES])
+
+    def write_xml(self, stream):
+        """Writes the phases as JUnit-XML properties, one testcase per
+        test and the totals on the suite.
+        """
+
+        stream.write('<?xml version="1.0" encoding="UTF-8"?>\n')
+        stream.write('<testsuite name="selenium-timing" tests="%d">\n'
+                     % len(self.tests))
+        self._write_properties(stream, self.totals(), '  ')
+        for test_id in self.tests:
+            phases = self.timings[test_id]
+            if '.' in test_id:
+                classname, name = test_id.rsplit('.', 1)
+            else:
+                classname, name = '', test_id
+            stream.write('  <testcase classname=%s name=%s time="%.3f">\n'
+                         % (quoteattr(classname), quoteattr(name),
+                            sum(phases.values())))
+            self._write_properties(stream, phases, '    ')
+            stream.write('  </testcase>\n')
+        stream.write('</testsuite>\n')
+
+    def _write_properties(self, stream, phases, indent):
+        stream.write('%s<properties>\n' % indent)
+        for phase in PHASES:
+            if phase in phases:
+                stream.write('%s  <property name="selenium.%s" '
+                             'value="%.6f"/>\n'
+                             % (indent, phase, phases[phase]))
+        stream.write('%s</properties>\n' % indent)
+
+
+timer = PhaseTimer()
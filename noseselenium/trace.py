@@ -0,0 +1,188 @@
+# -*- coding: utf-8 -*-
+"""
+noseselenium.trace
+~~~~~~~~~~~~~~~~~~
+
+Recording and replaying the commands a selenium client sends. A trace file
+starts with a JSON header line followed by one JSON array per command::
+
+   {"version": 1, "browser": "*firefox", "url": "http://127.0.0.1:8000/"}
+   [0.0, 0.412, true, "getNewBrowserSession", ["*firefox", "..."]]
+   [0.415, 0.051, true, "open", ["/"]]
+
+The fields are the offset from the start of the trace, the duration and
+the success of the command, followed by the command and its arguments.
+
+Replaying traces against a server benchmarks its command throughput::
+
+   python -m noseselenium.trace --host 127.0.0.1 --port 4444 test.trace
+
+:copyright: 2010-2011, Pascal Hartig <phartig@weluse.de>
+:license: BSD, see LICENSE for more details.
+"""
+
+import sys
+import json
+import time
+
+from timeit import default_timer
+
+from noseselenium.client import SeleniumClient
+
+
+TRACE_VERSION = 1
+
+# Commands that manage the session instead of driving the browser. They are
+# issued by the replaying client itself.
+SESSION_VERBS = frozenset([
+    'getNewBrowserSession', 'testComplete', 'shutDownSeleniumServer',
+])
+
+
+class CommandTrace(object):
+    """The commands sent by a client, in order."""
+
+    def __init__(self, browser=None, url=None, commands=None):
+        self.browser = browser
+        self.url = url
+        self.commands = commands or []
+        self.started = default_timer()
+
+    def record(self, verb, args, started, duration, ok):
+        """Appends a command that was sent at `started`."""
+
+        self.commands.append((started - self.started, duration, ok, verb,
+                              list(args)))
+
+    def save(self, path):
+        """Writes the trace to `path`."""
+
+        output = open(path, 'w')
+        try:
+            json.dump({
+                'version': TRACE_VERSION,
+                'browser': self.browser,
+                'url': self.url,
+            }, output, sort_keys=True)
+            output.write('\n')
+            for command in self.commands:
+                json.dump(command, output, separators=(',', ':'))
+                output.write('\n')
+        finally:
+            output.close()
+
+    @classmethod
+    def load(cls, path):
+        """Reads a trace written by :meth:`save`."""
+
+        input = open(path)
+        try:
+            header = json.loads(input.readline())
+            if header.get('version') != TRACE_VERSION:
+                raise ValueError("Unsupported trace version in %s: %r"
+                                 % (path, header.get('version')))
+            commands = [tuple(json.loads(line)) for line in input
+                        if line.strip()]
+        finally:
+            input.close()
+
+        return cls(header.get('browser'), header.get('url'), commands)
+
+
+def replay(client, trace, timing=False):
+    """
+    Issues the commands of `trace` with a started `client`. With `timing`
+    enabled, the original pauses between commands are kept, otherwise the
+    commands are sent back to back.
+
+    Returns a dict with the number of commands and errors, the total
+    duration and the summed up duration per command.
+    """
+
+    durations = {}
+    errors = 0
+    start = default_timer()
+
+    for offset, duration, ok, verb, args in trace.commands:
+        if verb in SESSION_VERBS:
+            continue
+        if timing:
+            delay = offset - (default_timer() - start)
+            if delay > 0:
+                time.sleep(delay)
+
+        command_start = default_timer()
+        try:
+            client.do_command(verb, args)
+        except Exception:
+            errors += 1
+        durations.setdefault(verb, []).append(default_timer() -
+                                              command_start)
+
+    total = default_timer() - start
+    count = sum([len(values) for values in durations.values()])
+    return {
+        'commands': count,
+        'errors': errors,
+        'seconds': total,
+        'commands_per_second': total and count / total or None,
+        'verbs': dict([(verb, {
+            'count': len(values),
+            'mean': sum(values) / len(values),
+            'max': max(values),
+        }) for verb, values in durations.items()]),
+    }
+
+
+def main():
+    """Replays the given trace files and prints the results as JSON."""
+
+    from optparse import OptionParser
+
+    parser = OptionParser(usage="%prog [options] TRACE [TRACE ...]")
+    parser.add_option('--host', default='127.0.0.1')
+    parser.add_option('--port', type='int', default=4444)
+    parser.add_option('--browser',
+                      help="Browser start command, defaults to the recorded "
+                           "one.")
+    parser.add_option('--url',
+                      help="Browser URL, defaults to the recorded one.")
+    parser.add_option('--timing', action='store_true', default=False,
+                      help="Keep the recorded pauses between commands.")
+    parser.add_option('--fake', action='store_true', default=False,
+                      help="Replay against an in-process fake server.")
+    parser.add_option('--fake-latency', type='float', default=0,
+                      help="Latency of the fake server in seconds.")
+    options, paths = parser.parse_args()
+    if not paths:
+        parser.error("No trace given.")
+
+    server = None
+    if options.fake:
+        from noseselenium.fakeserver import FakeSeleniumServer
+        server = FakeSeleniumServer(latency=options.fake_latency)
+        server.start()
+        options.host, options.port = server.host, server.port
+
+    results = {}
+    try:
+        for path in paths:
+            trace = CommandTrace.load(path)
+            client = SeleniumClient(options.host, options.port,
+                                    options.browser or trace.browser,
+                                    options.url or trace.url)
+            client.start()
+            try:
+                results[path] = replay(client, trace, options.timing)
+            finally:
+                client.stop()
+    finally:
+        if server is not None:
+            server.stop()
+
+    json.dump(results, sys.stdout, indent=2, sort_keys=True)
+    sys.stdout.write('\n')
+
+
+if __name__ == '__main__':
+    main()
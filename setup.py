@@ -40,8 +40,16 @@ setup(
         'nose.plugins.0.10': [
             'selenium = noseselenium.plugins:SeleniumPlugin',
             'selenium_fixtures = noseselenium.plugins:SeleniumFixturesPlugin',
+            'selenium_timing = noseselenium.plugins:SeleniumTimingPlugin',
+            'selenium_ordering = noseselenium.plugins:SeleniumOrderingPlugin',
+            'selenium_shard = noseselenium.plugins:SeleniumShardPlugin',
             'cherrypyliveserver = noseselenium.plugins:CherryPyLiveServerPlugin',
-            'djangoliveserver = noseselenium.plugins:DjangoLiveServerPlugin'
+            'djangoliveserver = noseselenium.plugins:DjangoLiveServerPlugin',
+            'asyncliveserver = noseselenium.plugins:AsyncLiveServerPlugin'
+        ],
+        'console_scripts': [
+            'noseselenium-replay = noseselenium.trace:main',
+            'noseselenium-compile-fixtures = noseselenium.fixtures:main'
         ]
     }
 )
@@ -0,0 +1,89 @@
+# -*- coding: utf-8 -*-
+"""
+tests.test_asyncserver
+~~~~~~~~~~~~~~~~~~~~~~
+
+Tests for the event loop based live server. Run them with::
+
+   nosetests tests
+
+:copyright: 2010-2011, Pascal Hartig <phartig@weluse.de>
+:license: BSD, see LICENSE for more details.
+"""
+
+import httplib
+import unittest
+
+from noseselenium.asyncserver import AsyncWSGIServer
+
+
+def application(environ, start_response):
+    """Answers conditional requests with a 304 and ``/empty`` with a 204,
+    everything else with a body of unknown length.
+    """
+
+    if environ.get('HTTP_IF_MODIFIED_SINCE'):
+        start_response('304 Not Modified', [])
+        return []
+    if environ['PATH_INFO'] == '/empty':
+        start_response('204 No Content', [])
+        return []
+    start_response('200 OK', [('Content-Type', 'text/plain')])
+    return ['hello ', 'world']
+
+
+class BodilessResponseTest(unittest.TestCase):
+
+    def setUp(self):
+        self.server = AsyncWSGIServer(('127.0.0.1', 0), application,
+                                      threads=1)
+        self.server.start()
+        self.connection = httplib.HTTPConnection('127.0.0.1',
+                                                 self.server.server_port)
+
+    def tearDown(self):
+        self.connection.close()
+        self.server.stop()
+
+    def request(self, method='GET', path='/', headers={}):
+        self.connection.request(method, path, headers=headers)
+        response = self.connection.getresponse()
+        return response, response.read()
+
+    def test_chunked_body(self):
+        response, body = self.request()
+        self.assertEqual(response.status, 200)
+        self.assertEqual(response.getheader('Transfer-Encoding'), 'chunked')
+        self.assertEqual(body, 'hello world')
+
+    def test_not_modified_keeps_connection_usable(self):
+        response, body = self.request(headers={
+            'If-Modified-Since': 'Sat, 01 Jan 2011 00:00:00 GMT'})
+        self.assertEqual(response.status, 304)
+        self.assertEqual(response.getheader('Transfer-Encoding'), None)
+        self.assertEqual(response.getheader('Connection'), 'keep-alive')
+
+        # A terminating chunk after the 304 would be read as the status
+        # line of this response.
+        response, body = self.request()
+        self.assertEqual(response.status, 200)
+        self.assertEqual(body, 'hello world')
+
+    def test_no_content_keeps_connection_usable(self):
+        response, body = self.request(path='/empty')
+        self.assertEqual(response.status, 204)
+        self.assertEqual(response.getheader('Transfer-Encoding'), None)
+
+        response, body = self.request()
+        self.assertEqual(response.status, 200)
+        self.assertEqual(body, 'hello world')
+
+    def test_head_keeps_connection_usable(self):
+        response, body = self.request('HEAD')
+        self.assertEqual(response.status, 200)
+        self.assertEqual(response.getheader('Transfer-Encoding'), None)
+        self.assertEqual(body, '')
+
+        response, body = self.request()
+        self.assertEqual(response.status, 200)
+        self.assertEqual(body, 'hello world')
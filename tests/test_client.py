@@ -0,0 +1,63 @@
+# -*- coding: utf-8 -*-
+"""
+tests.test_client
+~~~~~~~~~~~~~~~~~
+
+Tests for the locator cache of the selenium client.
+
+:copyright: 2010-2011, Pascal Hartig <phartig@weluse.de>
+:license: BSD, see LICENSE for more details.
+"""
+
+import unittest
+
+from noseselenium.client import SeleniumClient
+from noseselenium.fakeserver import FakeSeleniumServer
+
+
+def get_attribute(args):
+    """Only the element found by ``css=#main`` has an id."""
+
+    if args[0] == 'css=#main@id':
+        return u'main'
+    return u''
+
+
+class LocatorCacheTest(unittest.TestCase):
+
+    def setUp(self):
+        self.server = FakeSeleniumServer(
+            responses={'getAttribute': get_attribute})
+        self.server.start()
+        self.client = SeleniumClient(self.server.host, self.server.port,
+                                     '*firefox', 'http://localhost/',
+                                     cache_locators=True)
+        self.client.start()
+
+    def tearDown(self):
+        self.client.stop()
+        self.server.stop()
+
+    def get_commands(self):
+        return [(verb, args) for session_id, verb, args
+                in self.server.commands if verb not in
+                ('getNewBrowserSession', 'testComplete')]
+
+    def test_existing_id(self):
+        self.client.click('css=#main')
+        self.client.click('css=#main')
+        self.assertEqual(self.get_commands(), [
+            ('getAttribute', ['css=#main@id']),
+            ('click', ['id=main']),
+            ('click', ['id=main']),
+        ])
+
+    def test_assigned_id(self):
+        self.client.click('//a')
+        self.client.click('//a')
+        self.assertEqual(self.get_commands(), [
+            ('getAttribute', ['//a@id']),
+            ('assignId', ['//a', 'noseselenium-1']),
+            ('click', ['id=noseselenium-1']),
+            ('click', ['id=noseselenium-1']),
+        ])
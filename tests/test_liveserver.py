@@ -0,0 +1,80 @@
+# -*- coding: utf-8 -*-
+"""
+tests.test_liveserver
+~~~~~~~~~~~~~~~~~~~~~
+
+Tests for the test database handling of the live server plugins.
+
+:copyright: 2010-2011, Pascal Hartig <phartig@weluse.de>
+:license: BSD, see LICENSE for more details.
+"""
+
+import os
+import shutil
+import tempfile
+import unittest
+
+from optparse import OptionParser
+from nose.config import Config
+
+db_dir = None
+
+
+def setup_module():
+    global db_dir
+
+    from django.conf import settings
+
+    db_dir = tempfile.mkdtemp()
+    if not settings.configured:
+        settings.configure(
+            DATABASES={'default': {
+                'ENGINE': 'django.db.backends.sqlite3',
+                'NAME': os.path.join(db_dir, 'db.sqlite'),
+                'TEST_NAME': os.path.join(db_dir, 'test_db.sqlite'),
+            }},
+            INSTALLED_APPS=['django.contrib.contenttypes'],
+            LIVE_SERVER_CLONE_TEST_DB=True,
+        )
+
+
+def teardown_module():
+    shutil.rmtree(db_dir)
+
+
+class CloneTeardownTest(unittest.TestCase):
+
+    def run_plugin(self, shard=None):
+        """Runs the live server plugin of the shard `shard` between the
+        setup and teardown of the test databases.
+        """
+
+        from django.db import connections
+        from django.test.simple import DjangoTestSuiteRunner
+        from noseselenium.plugins import DjangoLiveServerPlugin
+
+        plugin = DjangoLiveServerPlugin()
+        parser = OptionParser()
+        plugin.addOptions(parser, env={})
+        options, args = parser.parse_args(['--with-djangoliveserver'])
+        options.selenium_shard = shard
+        plugin.configure(options, Config())
+
+        runner = DjangoTestSuiteRunner(verbosity=0)
+        old_config = runner.setup_databases()
+        try:
+            plugin.begin()
+            name = connections['default'].settings_dict['NAME']
+            self.assertTrue(os.path.exists(name))
+            self.assertNotEqual(name, os.path.join(db_dir, 'test_db.sqlite'))
+            plugin.finalize(None)
+        finally:
+            runner.teardown_databases(old_config)
+
+    def test_single_process(self):
+        self.run_plugin()
+        self.assertEqual(os.listdir(db_dir), [])
+
+    def test_shard(self):
+        self.run_plugin('1/2')
+        self.assertEqual(os.listdir(db_dir), [])